@@ -5,3 +5,13 @@ then type `look` to see where you are
 you go say `go west` or `go w` to go into the bathroom
 
 or `go east` to go back to the living room
+
+To let many people play the same world at once, run `python3 server.py`
+and connect with `nc localhost 4000` (see `python3 server.py --help`)
+
+`python3 bench.py` benchmarks building worlds and running commands
+
+Worlds can also be written as data, see `worldfile.py` and `sample.world`
+
+`python3 explore.py` tries every command sequence of a world and reports
+rooms never reached, reactions never run and commands that raise
@@ -0,0 +1,87 @@
+'''
+Compiled worlds: a world checked once and saved with everything already
+built (parser vocabularies, compiled reactions, the room graph), so it
+loads with one read instead of running the code that configured it.
+
+    python3 artifact.py main world.ptw
+
+builds world.ptw from the world in main.py. Load it with `load`, or serve
+it with `python3 server.py --world world.ptw`. Worker processes forked
+after loading share the loaded world's pages until they change them.
+'''
+import gc
+import mmap
+import pickle
+import struct
+import sys
+
+MAGIC = b'PTGW'
+VERSION = 1
+
+def validate(world):
+    '''
+    Raises if the world refers to rooms or objects it does not have
+    '''
+    problems = []
+    rooms = world.rooms
+    start_room = world.character.start_room
+    if start_room == None:
+        problems.append('no starting room')
+    elif start_room not in rooms.rooms:
+        problems.append('starting room "%s" does not exist' % start_room)
+
+    for from_room in rooms.mappings:
+        if from_room not in rooms.rooms:
+            problems.append('mapped room "%s" does not exist' % from_room)
+
+    for room in rooms.rooms.values():
+        for object in room.objects:
+            if world.objects.get(object) == None:
+                problems.append('object "%s" in room "%s" does not exist' % (object, room.name))
+
+    if problems:
+        raise Exception('Invalid world:\n\t' + '\n\t'.join(problems))
+    return world
+
+def dumps(world):
+    world = validate(world).freeze()
+    try:
+        payload = pickle.dumps(world, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as error:
+        raise Exception('The world can not be compiled, reactions and predicates '
+                        'must be defined at module level: %s' % error)
+    return MAGIC + struct.pack('>BQ', VERSION, len(payload)) + payload
+
+def loads(data):
+    data = memoryview(data)
+    if bytes(data[:4]) != MAGIC:
+        raise Exception('Not a compiled world')
+    version, length = struct.unpack('>BQ', data[4:13])
+    if version != VERSION:
+        raise Exception('Unknown compiled world version %d' % version)
+    # the collector would otherwise keep walking the objects being made
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(data[13:13 + length])
+    finally:
+        if enabled:
+            gc.enable()
+
+def build(world, path):
+    with open(path, 'wb') as file:
+        file.write(dumps(world))
+    return path
+
+def load(path):
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return loads(data)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python3 artifact.py <world module> <output file>')
+        sys.exit(1)
+
+    import server
+    build(server.load_world(sys.argv[1]), sys.argv[2])
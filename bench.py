@@ -0,0 +1,346 @@
+'''
+Benchmarks for building worlds and running commands.
+
+    python3 bench.py
+    python3 bench.py --scales 10 1000 100000 --commands 20000
+
+Each world is built through the configure_* api, then a transcript is
+replayed through Game.execute (with a NullSink) and Game.execute_many.
+
+    python3 bench.py --journal 100000
+
+also times journaling that many commands and recovering from the journal.
+
+    python3 bench.py --threads 8
+
+also plays many games of one world on a thread pool, checking each game
+ends up exactly as it does when played alone.
+
+    python3 bench.py --predicates 100000
+
+also plays that many commands checking a cached predicate, checking the
+game's predicate cache does not grow with the number of commands.
+'''
+import argparse
+import concurrent.futures
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from lib import *
+from sinks import NullSink, ListSink
+from journal import Journal
+import predicates
+import side_effects
+import main
+
+# a walk through the sample world in main.py
+SAMPLE_TRANSCRIPT = [
+    'look', 'talk to crab', 'take key', 'inv', 'go west', 'look',
+    'use towel on car', 'look car', 'take towel', 'use key on towel',
+    'use towel on car', 'take car', 'i', 'go east', 'drop towel',
+    'use crab on towel', 'eat key', 'go west', 'drop towel', 'look',
+    'go east', 'look crab', 'foo'
+]
+
+def synthetic_world(rooms, objects=None, seed=0):
+    '''
+    A grid of rooms with objects scattered through them. Anything can be
+    eaten, some objects only while held, and some pairs of objects can be
+    used on each other.
+    '''
+    rng = random.Random(seed)
+    objects = rooms if objects == None else objects
+
+    world = World()
+    world.configure_directions() \
+        .direction('east', 'e') \
+        .direction('west', 'w') \
+        .direction('north', 'n') \
+        .direction('south', 's') \
+        .opposite('east', 'west') \
+        .opposite('north', 'south')
+
+    world.configure_actions() \
+        .action('look', 'l', 'inspect') \
+        .action('take', 't', 'pick up') \
+        .action('inventory', 'inv', 'i') \
+        .action('go', 'g', 'walk') \
+        .action('use', 'u') \
+        .action('eat', 'consume', progn(side_effects.destroy(), succeed('You eat it.'))) \
+        .action('drop', 'd')
+
+    contents = [[] for i in range(rooms)]
+    for i in range(objects):
+        contents[rng.randrange(rooms)].append('thing %d' % i)
+
+    configure_objects = world.configure_objects()
+    for i in range(objects):
+        name = 'thing %d' % i
+        configure_objects.object(name, 'Thing number %d.' % i, ['look', 'take', 'drop', 'use'])
+        if i % 10 == 0:
+            configure_objects.on(name, 'eat', cond(
+                predicates.inventory_has(name),
+                progn(side_effects.remove_from_inventory(), succeed('Yum')),
+                fail('You have to be holding it.')))
+        if i % 7 == 0 and i + 1 < objects:
+            configure_objects.on_use(name, 'thing %d' % (i + 1), progn(
+                side_effects.change_description(name, 'A used thing.'),
+                succeed('Click.')))
+
+    width = max(1, int(rooms ** 0.5))
+    configure_rooms = world.configure_rooms()
+    for i in range(rooms):
+        configure_rooms.room('room %d' % i, 'Room number %d.' % i, contents[i])
+    for i in range(rooms):
+        if (i + 1) % width and i + 1 < rooms:
+            configure_rooms.map('room %d' % i, 'east', 'room %d' % (i + 1))
+        if i + width < rooms:
+            configure_rooms.map('room %d' % i, 'south', 'room %d' % (i + width))
+
+    world.configure_character().starting_room('room 0')
+    return world
+
+def random_transcript(world, length, seed=0):
+    '''
+    Commands a player might type, picked by playing the world so objects
+    are mostly ones that are actually around
+    '''
+    rng = random.Random(seed)
+    game = Game(world, NullSink())
+    directions = [direction[0] for direction in world.directions.directions]
+    commands = []
+    for i in range(length):
+        here = list(game.get_room_objects(game.room))
+        held = list(game.get_inventory())
+        roll = rng.random()
+        if roll < 0.3:
+            command = 'go %s' % rng.choice(directions)
+        elif roll < 0.45:
+            command = 'look'
+        elif roll < 0.55 and here:
+            command = 'take %s' % rng.choice(here)
+        elif roll < 0.6 and held:
+            command = 'drop %s' % rng.choice(held)
+        elif roll < 0.65 and held:
+            command = 'eat %s' % rng.choice(held)
+        elif roll < 0.75 and held and here + held:
+            command = 'use %s on %s' % (rng.choice(held), rng.choice(here + held))
+        elif roll < 0.85 and here + held:
+            command = 'look %s' % rng.choice(here + held)
+        elif roll < 0.95:
+            command = 'inv'
+        else:
+            command = 'dance around'
+        game.execute(command)
+        commands.append(command)
+    return commands
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def measure_build(build, memory=True):
+    start = time.perf_counter()
+    world = build()
+    build_time = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        build()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return world, build_time, peak
+
+def replay(world, commands):
+    '''
+    Runs commands one at a time through Game.execute, timing each one
+    '''
+    game = Game(world, NullSink())
+    clock = time.perf_counter
+    latencies = []
+    start = clock()
+    for command in commands:
+        before = clock()
+        game.execute(command)
+        latencies.append(clock() - before)
+    total = clock() - start
+    latencies.sort()
+    return {
+        'commands/s': len(commands) / total if total else 0.0,
+        'p50 us': percentile(latencies, 0.5) * 1e6,
+        'p99 us': percentile(latencies, 0.99) * 1e6
+    }
+
+def replay_many(world, commands):
+    game = Game(world, NullSink())
+    start = time.perf_counter()
+    game.execute_many(commands)
+    total = time.perf_counter() - start
+    return len(commands) / total if total else 0.0
+
+def run(name, build, commands_for, memory=True):
+    world, build_time, peak = measure_build(build, memory)
+    commands = commands_for(world)
+    row = {'world': name, 'build s': build_time,
+           'peak MB': peak / 1e6 if peak != None else None}
+    row.update(replay(world, commands))
+    row['many commands/s'] = replay_many(world, commands)
+    row['commands'] = len(commands)
+    return row
+
+def run_journal(world, commands, sync_every, checkpoint_every, history=0):
+    '''
+    Plays commands with a journal, then recovers a new game from it
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        journal = Journal(os.path.join(directory, 'journal'), sync_every, checkpoint_every)
+        game = Game(world, NullSink()).set_history(history).set_journal(journal)
+        start = time.perf_counter()
+        for command in commands:
+            game.execute(command)
+        play_time = time.perf_counter() - start
+
+        recovered = Game(world, NullSink()).set_history(history)
+        start = time.perf_counter()
+        replayed = Journal(journal.path).recover(recovered)
+        recover_time = time.perf_counter() - start
+        journal.close()
+
+        if recovered.snapshot() != game.snapshot():
+            raise Exception('Recovered game does not match')
+        return {'sync every': sync_every, 'checkpoint every': checkpoint_every, 'history': history,
+                'commands': len(commands), 'commands/s': len(commands) / play_time,
+                'replayed': replayed, 'recover s': recover_time}
+
+def play(world, commands):
+    game = Game(world, ListSink())
+    for command in commands:
+        game.execute(command)
+    return (game.sink.getvalue(), game.snapshot())
+
+def stress(world, sessions, length, threads):
+    '''
+    Plays games of one world on many threads at once, switching threads as
+    often as possible, and raises if any game differs from playing it alone
+    '''
+    transcripts = [random_transcript(world, length, seed) for seed in range(sessions)]
+    expected = [play(world, transcript) for transcript in transcripts]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            actual = list(pool.map(lambda transcript: play(world, transcript), transcripts))
+        total = time.perf_counter() - start
+    finally:
+        sys.setswitchinterval(interval)
+
+    leaked = sum(1 for i in range(sessions) if actual[i] != expected[i])
+    if leaked:
+        raise Exception('%d of %d games ended differently on threads' % (leaked, sessions))
+    return {'threads': threads, 'games': sessions, 'commands': sessions * length,
+            'commands/s': sessions * length / total}
+
+def explored(game, rooms):
+    return len(game.visited_rooms) >= rooms
+
+def predicate_cache(rooms, length, seed=0):
+    '''
+    Plays a world where every other command checks a cached predicate that
+    reads the visited rooms and the turn, and raises if what the game keeps
+    for the cache grows with the number of commands
+    '''
+    world = synthetic_world(rooms, seed=seed)
+    world.predicate('explored', explored, ('visited', 'turn'))
+    world.configure_actions().action('wait', 'z', cond(
+        predicates.Predicate('explored', rooms // 2),
+        succeed('You have seen enough.'),
+        succeed('There is more to see.')))
+
+    transcript = random_transcript(world, length // 2, seed)
+    game = Game(world, NullSink())
+    start = time.perf_counter()
+    for command in transcript:
+        game.execute(command)
+        game.execute('wait')
+    total = time.perf_counter() - start
+
+    kept = sum(len(keys) for keys in game.readers.values())
+    if len(game.checks) > 1 or kept > 2 * len(game.checks):
+        raise Exception('The predicate cache kept %d results and %d readers after %d commands'
+                        % (len(game.checks), kept, game.turn))
+    return {'commands': game.turn, 'commands/s': game.turn / total,
+            'results': len(game.checks), 'readers': kept}
+
+def report(rows, columns=None):
+    columns = columns or ['world', 'commands', 'build s', 'peak MB', 'commands/s', 'p50 us', 'p99 us', 'many commands/s']
+    print(' '.join('%16s' % column for column in columns))
+    for row in rows:
+        cells = []
+        for column in columns:
+            value = row[column]
+            if value == None:
+                cells.append('%16s' % '-')
+            elif type(value) == float:
+                cells.append('%16.3f' % value if value < 100 else '%16.0f' % value)
+            else:
+                cells.append('%16s' % value)
+        print(' '.join(cells))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark building and playing worlds')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 1000],
+                        help='number of rooms (and objects) in each synthetic world')
+    parser.add_argument('--commands', type=int, default=10000,
+                        help='length of each random transcript')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip measuring peak memory')
+    parser.add_argument('--journal', type=int, default=0,
+                        help='also time journaling and recovering this many commands')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='also play games on this many threads at once')
+    parser.add_argument('--predicates', type=int, default=0,
+                        help='also play this many commands checking a cached predicate')
+    args = parser.parse_args()
+
+    memory = not args.no_memory
+    repeats = max(1, args.commands // len(SAMPLE_TRANSCRIPT))
+    rows = [run('sample', main.build_world, lambda world: SAMPLE_TRANSCRIPT * repeats, memory)]
+    for scale in args.scales:
+        rows.append(run('synthetic %d' % scale,
+                        lambda: synthetic_world(scale, seed=args.seed),
+                        lambda world: random_transcript(world, args.commands, args.seed),
+                        memory))
+    report(rows)
+
+    if args.journal:
+        world = main.build_world()
+        commands = (SAMPLE_TRANSCRIPT * (args.journal // len(SAMPLE_TRANSCRIPT) + 1))[:args.journal]
+        rows = []
+        for sync_every, checkpoint_every in [(1, 1000), (100, 1000), (0, 1000), (100, 0)]:
+            rows.append(run_journal(world, commands, sync_every, checkpoint_every))
+        # undoing across checkpoints, which have to keep the history, the
+        # last undo coming right after one
+        undoing = [command if i % 5 else 'undo' for i, command in enumerate(commands)]
+        undoing = undoing[:len(undoing) // 7 * 7] + ['undo']
+        rows.append(run_journal(world, undoing, 1, 7, history=10))
+        print()
+        report(rows, ['sync every', 'checkpoint every', 'history', 'commands', 'commands/s', 'replayed', 'recover s'])
+
+    if args.threads:
+        world = synthetic_world(100, seed=args.seed).freeze()
+        print()
+        report([stress(world, args.threads * 8, 500, args.threads)],
+               ['threads', 'games', 'commands', 'commands/s'])
+
+    if args.predicates:
+        print()
+        report([predicate_cache(100, args.predicates, args.seed)],
+               ['commands', 'commands/s', 'results', 'readers'])
@@ -0,0 +1,302 @@
+'''
+Plays every command sequence of a world, breadth first, to check the world
+before shipping it.
+
+    python3 explore.py main
+    python3 explore.py sample.world --depth 12 --states 1000000 --processes 8
+
+From each state every command that could matter is tried: each action on
+its own and on each object in the room or inventory, going in each
+direction, and using each object there on each other one. Games that end
+up in a state already seen are not explored further, states being compared
+by a hash of their snapshot. The turn is left out of it, so states that
+only differ in how many commands led to them are merged, while timers
+still count by how many turns they have left. The levels of the search are split between a
+pool of processes, each with its own copy of the world.
+
+It reports which rooms were never reached, which reactions never ran,
+which predicates were never true or never false, and, for every different
+error a command raised, the shortest transcript that raises it.
+'''
+import argparse
+import hashlib
+import multiprocessing
+import pickle
+import time
+
+from lib import Game, CompiledCond, CompiledProgn
+from sinks import NullSink
+import profiling
+
+class Tracker:
+    '''
+    A profiler that only notes which reactions run
+    '''
+    def __init__(self, labels):
+        self.labels = labels
+        self.reactions = set()
+
+    def begin(self):
+        pass
+
+    def enter(self, phase):
+        label = self.labels.get(phase) if type(phase) != str else None
+        if label != None:
+            self.reactions.add(label)
+
+    def switch(self, phase):
+        self.enter(phase)
+
+    def exit(self):
+        pass
+
+    def end(self, action):
+        pass
+
+def conds(reaction):
+    '''
+    Every cond in a compiled reaction
+    '''
+    if type(reaction) == CompiledCond:
+        yield reaction
+        yield from conds(reaction.then_part)
+        yield from conds(reaction.else_part)
+    elif type(reaction) == CompiledProgn:
+        for statement in reaction.statements:
+            yield from conds(statement)
+
+def watch(cond, label, outcomes):
+    check = cond.check
+    def watched(game, *args):
+        result = check(game, *args)
+        outcomes.add((label, bool(result)))
+        return result
+    cond.check = watched
+
+def instrument(world):
+    '''
+    Makes the conds of a world note what their predicates return. Returns
+    (reaction labels, cond labels, outcomes seen).
+
+    This changes the world, so only do it to a copy.
+    '''
+    labels = profiling.reaction_labels(world)
+    names = dict((world.predicates[name], name) for name in world.predicates)
+    cond_labels = []
+    outcomes = set()
+    for reaction in labels:
+        for cond in conds(reaction):
+            args = ', '.join(map(repr, cond.args))
+            label = '%s(%s) in %s' % (names.get(cond.check, cond.check), args, labels[reaction])
+            cond_labels.append(label)
+            watch(cond, label, outcomes)
+    return labels, cond_labels, outcomes
+
+def commands(game):
+    '''
+    The commands worth trying from where a game is
+    '''
+    world = game.world
+    if game.room == None:
+        return []
+    present = sorted(set(game.get_room_objects(game.room)) | set(game.get_inventory()))
+    found = []
+    for action in world.actions.actions:
+        name = ' '.join(action[0])
+        found.append(name)
+        if name == world.go_action_name:
+            for direction in world.directions.directions:
+                found.append('%s %s' % (name, direction[0]))
+        for object in present:
+            found.append('%s %s' % (name, object))
+        if name == 'use':
+            for source in present:
+                for target in present:
+                    if source != target:
+                        found.append('use %s on %s' % (source, target))
+    return found
+
+def digest(snapshot):
+    return hashlib.blake2b(snapshot, digest_size=16).digest()
+
+# the world a worker process explores, see `start_worker`
+worker = None
+
+def start_worker(data):
+    global worker
+    world = pickle.loads(data)
+    labels, cond_labels, outcomes = instrument(world)
+    worker = (world, Tracker(labels), outcomes)
+
+def expand(states):
+    '''
+    Tries every command from each of (hash, snapshot) states. Returns
+    (children, crashes, rooms, reactions, outcomes) where children are
+    (parent hash, command, hash, snapshot) and crashes are
+    (parent hash, command, error).
+    '''
+    world, tracker, outcomes = worker
+    tracker.reactions = set()
+    outcomes.clear()
+    children = []
+    crashes = []
+    rooms = set()
+    seen = set()
+    for (parent, snapshot) in states:
+        here = Game(world, NullSink()).restore(snapshot)
+        for command in commands(here):
+            game = here.fork().set_profiler(tracker)
+            try:
+                game.execute(command)
+            except Exception as error:
+                crashes.append((parent, command, '%s: %s' % (type(error).__name__, error)))
+                continue
+            rooms.add(game.room)
+            child = game.snapshot(False)
+            key = digest(child)
+            if key not in seen:
+                seen.add(key)
+                children.append((parent, command, key, child))
+    return (children, crashes, rooms, tracker.reactions, set(outcomes))
+
+def crashes_with(world, transcript, error):
+    game = Game(world, NullSink())
+    try:
+        for command in transcript:
+            game.execute(command)
+    except Exception as raised:
+        return '%s: %s' % (type(raised).__name__, raised) == error
+    return False
+
+def shrink(world, transcript, error):
+    '''
+    Drops commands from a crashing transcript for as long as it still
+    raises the same error
+    '''
+    transcript = list(transcript)
+    i = 0
+    while i < len(transcript) - 1:
+        shorter = transcript[:i] + transcript[i + 1:]
+        if crashes_with(world, shorter, error):
+            transcript = shorter
+        else:
+            i += 1
+    return transcript
+
+class Exploration:
+    '''
+    What exploring a world found
+    '''
+    def __init__(self):
+        self.states = 0
+        self.depth = 0
+        self.seconds = 0.0
+        self.rooms = set()
+        self.unreached_rooms = []
+        self.reactions = set()
+        self.unfired_reactions = []
+        self.outcomes = set()
+        self.unsettled_predicates = []
+        # error -> shortest transcript raising it
+        self.crashes = {}
+
+def explore(world, depth=10, states=100000, processes=None, chunk=64):
+    '''
+    Explores a world breadth first for up to `depth` commands or until
+    `states` different states were seen, on `processes` processes (all
+    cores if None, no pool if 1)
+    '''
+    start = time.perf_counter()
+    try:
+        data = pickle.dumps(world, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as error:
+        raise Exception('The world can not be explored, reactions and predicates '
+                        'must be defined at module level: %s' % error)
+
+    found = Exploration()
+    first = Game(world, NullSink())
+    if first.room != None:
+        found.rooms.add(first.room)
+    root = digest(first.snapshot(False))
+    # hash -> (parent hash, command), to give the transcript to any state
+    parents = {root: None}
+    frontier = [(root, first.snapshot(False))]
+
+    def transcript(key, command=None):
+        commands = [] if command == None else [command]
+        while parents[key] != None:
+            key, parent_command = parents[key]
+            commands.append(parent_command)
+        return commands[::-1]
+
+    pool = None
+    if processes != 1:
+        pool = multiprocessing.Pool(processes, start_worker, (data,))
+        run = pool.imap
+    else:
+        start_worker(data)
+        run = map
+
+    try:
+        while frontier and found.depth < depth and len(parents) < states:
+            found.depth += 1
+            chunks = [frontier[i:i + chunk] for i in range(0, len(frontier), chunk)]
+            frontier = []
+            for children, crashes, rooms, reactions, outcomes in run(expand, chunks):
+                found.rooms |= rooms
+                found.reactions |= reactions
+                found.outcomes |= outcomes
+                for parent, command, error in crashes:
+                    if error not in found.crashes:
+                        found.crashes[error] = transcript(parent, command)
+                for parent, command, key, child in children:
+                    if key not in parents and len(parents) < states:
+                        parents[key] = (parent, command)
+                        frontier.append((key, child))
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+
+    for error in found.crashes:
+        found.crashes[error] = shrink(world, found.crashes[error], error)
+
+    labels, cond_labels, outcomes = instrument(pickle.loads(data))
+    found.states = len(parents)
+    found.unreached_rooms = sorted(set(world.rooms.rooms.keys()) - found.rooms)
+    found.unfired_reactions = sorted(set(labels.values()) - found.reactions)
+    for label in cond_labels:
+        for outcome in (True, False):
+            if (label, outcome) not in found.outcomes:
+                found.unsettled_predicates.append('%s never %s' % (label, 'true' if outcome else 'false'))
+    found.seconds = time.perf_counter() - start
+    return found
+
+def report(found):
+    print('%d states, %d commands deep, %.1f s' % (found.states, found.depth, found.seconds))
+    print('%d rooms reached' % len(found.rooms))
+    for room in found.unreached_rooms:
+        print('\tnever reached %s' % room)
+    print('%d reactions ran' % len(found.reactions))
+    for label in found.unfired_reactions:
+        print('\tnever ran %s' % label)
+    for line in found.unsettled_predicates:
+        print('\t%s' % line)
+    print('%d errors' % len(found.crashes))
+    for error in found.crashes:
+        print('\t%s' % error)
+        for command in found.crashes[error]:
+            print('\t\t> %s' % command)
+
+if __name__ == '__main__':
+    import server
+
+    parser = argparse.ArgumentParser(description='Try every command sequence of a world')
+    parser.add_argument('world', nargs='?', default='main',
+                        help='module defining the world, a .world file or a compiled .ptw world')
+    parser.add_argument('--depth', type=int, default=10, help='longest transcript to try')
+    parser.add_argument('--states', type=int, default=100000, help='stop after this many states')
+    parser.add_argument('--processes', type=int, default=None, help='defaults to one per core')
+    args = parser.parse_args()
+
+    report(explore(server.load_world(args.world), args.depth, args.states, args.processes))
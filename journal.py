@@ -0,0 +1,110 @@
+import os
+import struct
+
+class Journal:
+    '''
+    An append-only log of the commands a game runs, written before each
+    command runs, plus a checkpoint of the game's state every so many
+    commands. After a crash `recover` loads the checkpoint and replays only
+    the commands logged after it.
+
+    Each command is handed to the OS as it is written, so it survives the
+    process dying. `sync_every` is how many commands are written between
+    fsyncs, which is what makes them survive the machine going down too:
+    1 loses nothing, larger numbers trade the last few commands for speed
+    and 0 leaves syncing to the OS. `checkpoint_every` is how many commands are
+    run between checkpoints (0 for never), which bounds how much is
+    replayed on recovery. A checkpoint due while the game can not be
+    snapshot (see Game.can_snapshot) waits until it can.
+
+    The checkpoint is kept next to the journal in `<path>.checkpoint` as
+    the journal offset it covers followed by a game snapshot, which has the
+    game's undo history, so the game being recovered has to keep as much
+    history (see Game.set_history) as the journaled one did.
+    '''
+    def __init__(self, path, sync_every=1, checkpoint_every=1000):
+        self.path = path
+        self.checkpoint_path = path + '.checkpoint'
+        self.sync_every = sync_every
+        self.checkpoint_every = checkpoint_every
+        self.file = None
+        self.unsynced = 0
+        self.since_checkpoint = 0
+
+    def open(self):
+        if self.file == None:
+            self.file = open(self.path, 'ab')
+        return self
+
+    def append(self, command):
+        self.open()
+        self.file.write(command.replace('\n', ' ').encode('utf-8') + b'\n')
+        self.file.flush()
+        self.unsynced += 1
+        if self.sync_every and self.unsynced >= self.sync_every:
+            self.sync()
+
+    def executed(self, game):
+        self.since_checkpoint += 1
+        if self.checkpoint_every and self.since_checkpoint >= self.checkpoint_every \
+           and game.can_snapshot():
+            self.checkpoint(game)
+
+    def sync(self):
+        if self.file != None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def checkpoint(self, game):
+        self.open()
+        self.sync()
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(struct.pack('>Q', self.file.tell()) + game.snapshot())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.checkpoint_path)
+        self.since_checkpoint = 0
+
+    def close(self):
+        if self.file != None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def recover(self, game):
+        '''
+        Brings a new game back to where the journaled game was. Returns how
+        many commands were replayed.
+        '''
+        offset = 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rb') as file:
+                data = file.read()
+            offset = struct.unpack('>Q', data[:8])[0]
+            game.restore(data[8:])
+
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            lines = file.read().split(b'\n')
+
+        # the last line is either empty or was cut off by the crash, in
+        # which case it is cut from the file so the next command written
+        # starts on a line of its own
+        if lines[-1]:
+            self.close()
+            with open(self.path, 'r+b') as file:
+                file.truncate(offset + sum(len(line) + 1 for line in lines[:-1]))
+        commands = [line.decode('utf-8', 'replace') for line in lines[:-1]]
+        for command in commands:
+            try:
+                game.execute_command(command, game.world.parse(command))
+            except Exception:
+                # it failed the same way when it was first run
+                pass
+        game.buffer = None
+        self.since_checkpoint = len(commands)
+        return len(commands)
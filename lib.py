@@ -1,41 +1,51 @@
-import re
+import collections
+import threading
 
 from side_effects import SideEffect
+from sinks import FileSink
+from scheduler import Scheduler, Timer
+import snapshot
 from predicates import Predicate
+import predicates
 
 class Character:
-    def __init__(self, game):
-        self.inventory = []
+    '''
+    How the player is set up in a world. What the player is carrying and
+    where they are lives in each game's `State`.
+    '''
+    def __init__(self, world):
+        self.start_room = None
         self.action_callbacks = {}
-        self.room_enter_callbacks = {}
-        self.room_exit_callbacks = {}
+        self.transitions = Transitions()
         self.inventory_limit = None
-        self.game = game
-
-    def add_to_inventory(self, object, force=False):
-        if force or self.inventory_limit == None or len(self.inventory) + 1 <= self.inventory_limit:
-            self.inventory.append(object)
-            return True
-        else:
-            return False
+        self.world = world
 
     def inventory_size(self, size):
         self.inventory_limit = size
         return self
     
     def starting_room(self, room):
-        self.room = room
+        self.start_room = room
+        self.world.room_ids.intern(room)
         return self
 
     def on(self, action_name, reaction):
-        self.action_callbacks[action_name] = reaction
+        self.action_callbacks[action_name] = self.world.compile(reaction)
         return self
 
     def on_exit(self, room_name, reaction):
-        self.room_exit_callbacks[room_name] = reaction
+        '''
+        Fires when you are leaving the room, or any room if room_name is None
+        '''
+        self.transitions.on('exit', room_name, None, self.world.compile(reaction))
+        return self
 
     def on_enter(self, room_name, reaction):
-        self.room_enter_callbacks[room_name] = reaction
+        '''
+        Fires when you are entering the room, or any room if room_name is None
+        '''
+        self.transitions.on('enter', None, room_name, self.world.compile(reaction))
+        return self
 
     def on_enter_from(self, from_room, to_room, reaction):
         '''
@@ -43,7 +53,8 @@ class Character:
 
         Fires when you are entering from living room to the bathroom
         '''
-        self.room_enter_from_callbacks[from_room + to_room] = reaction
+        self.transitions.on('enter', from_room, to_room, self.world.compile(reaction))
+        return self
 
     def on_exit_to(self, from_room, to_room, reaction):
         '''
@@ -51,12 +62,41 @@ class Character:
 
         Fire when you are exiting from the living room to the bathroom
         '''
-        self.room_exit_to_callbacks[from_room + to_room] = reaction
+        self.transitions.on('exit', from_room, to_room, self.world.compile(reaction))
+        return self
+
+class Transitions:
+    '''
+    Reactions to moving between rooms, kept by (event, from room, to room)
+    where None stands for any room. Any number of reactions can listen for
+    the same move.
+    '''
+    def __init__(self):
+        self.listeners = {}
+
+    def on(self, event, from_room, to_room, reaction):
+        self.listeners.setdefault((event, from_room, to_room), []).append(reaction)
+        return self
+
+    def get(self, event, from_room, to_room):
+        '''
+        The reactions for a move, the most specific ones first
+        '''
+        listeners = self.listeners
+        if not listeners:
+            return ()
+        found = []
+        for key in ((event, from_room, to_room), (event, from_room, None),
+                    (event, None, to_room), (event, None, None)):
+            if key in listeners:
+                found.extend(listeners[key])
+        return found
         
 
 class Object:
-    def __init__(self, name, description, actions):
+    def __init__(self, name, description, actions, id=None):
         self.name = name
+        self.id = id
         self.description = description
         self.actions = actions
         self.callbacks = {}
@@ -71,56 +111,243 @@ class Object:
         self.callbacks[action_name] = reaction
         return self
 
-# matches should be list of list (list of tokens
-# [['this'], ['this', 'or', 'that']]
-def eat(matches, tokens):
-    for match_tokens in matches:
-        equal = True
-        for i in range(len(match_tokens)):
-            if i >= len(tokens) or match_tokens[i] != tokens[i]:
-                equal = False
-                break;
-        if equal:
-            for i in range(len(match_tokens)):
-                tokens.pop(0)
-            return match_tokens
+# shorter tokens are too close to too many others to correct
+TYPO_MIN_LENGTH = 3
 
-def list_startswith(list1, list2):
-    if len(list1) > len(list2):
+def deletions(token):
+    '''
+    Every way of dropping one letter from a token
+    '''
+    return [token[:i] + token[i + 1:] for i in range(len(token))]
+
+def is_typo(token, word):
+    '''
+    Whether token is word with one letter changed, added or dropped, or
+    two letters next to each other swapped
+    '''
+    if abs(len(token) - len(word)) > 1 or token == word:
         return False
-    
-    for i in range(len(list1)):
-        if list1[i] != list2[i]:
-            return False
-    return True
+    i = 0
+    while i < len(token) and i < len(word) and token[i] == word[i]:
+        i += 1
+    if len(token) < len(word):
+        return token[i:] == word[i + 1:]
+    if len(token) > len(word):
+        return token[i + 1:] == word[i:]
+    if token[i + 1:] == word[i + 1:]:
+        return True
+    return i + 1 < len(token) and token[i] == word[i + 1] and token[i + 1] == word[i] \
+        and token[i + 2:] == word[i + 2:]
+
+class Vocabulary:
+    '''
+    Token trie of every phrase (list of tokens) the parser knows, built
+    up as phrases are added. Each phrase maps to a value (the canonical
+    name), and `eat` finds the longest phrase at the front of a token list
+    in time proportional to the phrase length.
+
+    Once `allow_typos` is called, matching can also take a token that is
+    one typo away from a known one. Every token's one letter deletions
+    are indexed, so a typo is found by looking up the deletions of the
+    typed token instead of comparing it with every known token.
+    '''
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+        # token or one of its deletions -> tokens, when typos are allowed
+        self.typos = None
+
+    def add(self, phrase, value):
+        node = self.root
+        for token in phrase:
+            node = node.setdefault(token, {})
+            if self.typos != None:
+                self.index(token)
+
+        # the first phrase registered wins, like the old linear scan
+        if None not in node:
+            node[None] = value
+            self.size += 1
+        return self
+
+    def allow_typos(self):
+        if self.typos == None:
+            self.typos = {}
+            nodes = [self.root]
+            for node in nodes:
+                for token in node:
+                    if token != None:
+                        self.index(token)
+                        nodes.append(node[token])
+        return self
+
+    def index(self, token):
+        if len(token) >= TYPO_MIN_LENGTH:
+            for variant in [token] + deletions(token):
+                self.typos.setdefault(variant, set()).add(token)
+
+    def correct(self, token, node):
+        '''
+        The token following node that token is a typo of, or None if there
+        is not exactly one
+        '''
+        if self.typos == None or len(token) < TYPO_MIN_LENGTH:
+            return None
+        found = None
+        for variant in [token] + deletions(token):
+            for word in self.typos.get(variant, ()):
+                if word != found and word in node and is_typo(token, word):
+                    if found != None:
+                        return None
+                    found = word
+        return found
+
+    def get(self, phrase):
+        node = self.root
+        for token in phrase:
+            node = node.get(token)
+            if node is None:
+                return None
+        return node.get(None)
+
+    def match(self, tokens, typos=False):
+        '''
+        Returns (value, length) of the longest phrase at the start of
+        tokens, correcting typos in them if `typos`
+        '''
+        node = self.root
+        value = None
+        length = 0
+        for i, token in enumerate(tokens):
+            next_node = node.get(token)
+            if next_node is None and typos:
+                token = self.correct(token, node)
+                next_node = node.get(token) if token != None else None
+            if next_node is None:
+                break
+            node = next_node
+            if None in node:
+                value = node[None]
+                length = i + 1
+        return (value, length)
+
+    def eat(self, tokens, typos=False):
+        value, length = self.match(tokens, typos)
+        if length:
+            del tokens[:length]
+            return value
+
+    def __len__(self):
+        return self.size
+
+class Names:
+    '''
+    Numbers names 0, 1, 2... in the order they are first seen, so games
+    can keep small integers (and bits) instead of strings
+    '''
+    def __init__(self):
+        # name -> id
+        self.ids = {}
+        # id -> name
+        self.names = []
+        self.lock = threading.Lock()
+
+    def intern(self, name):
+        id = self.ids.get(name)
+        if id == None:
+            # side effects can bring up new names while games on other
+            # threads are playing the world
+            with self.lock:
+                id = self.ids.get(name)
+                if id == None:
+                    id = len(self.names)
+                    self.names.append(name)
+                    self.ids[name] = id
+        return id
+
+    def get(self, name):
+        return self.ids.get(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        return {'names': self.names}
+
+    def __setstate__(self, state):
+        self.names = state['names']
+        self.ids = dict((name, id) for (id, name) in enumerate(self.names))
+        self.lock = threading.Lock()
+
+class Cache(dict):
+    '''
+    A dict of at most `limit` entries, the least recently used (see `use`
+    and `keep`) making room for new ones
+    '''
+    def __init__(self, limit):
+        dict.__init__(self)
+        self.limit = limit
+
+    def use(self, key):
+        '''
+        What is kept for key, now the most recently used, or None
+        '''
+        value = self.pop(key, None)
+        if value != None:
+            self[key] = value
+        return value
+
+    def keep(self, key, value):
+        if len(self) >= self.limit:
+            # games on other threads may be changing the cache too
+            try:
+                self.pop(next(iter(self)), None)
+            except (RuntimeError, StopIteration):
+                pass
+        self[key] = value
+        return value
 
 class Objects:
-    def __init__(self, game):
+    def __init__(self, world):
         self.objects = []
-        self.game = game
+        # name -> Object
+        self.index = {}
+        self.world = world
+        # (source id, target id) -> reaction
         self.use_callbacks = {}
+        self.vocabulary = Vocabulary()
 
     def on_use(self, source, target, reaction, bidirectional=True):
-        self.use_callbacks[source + target] = reaction
+        reaction = self.world.compile(reaction)
+        object_ids = self.world.object_ids
+        source = object_ids.intern(source)
+        target = object_ids.intern(target)
+        self.use_callbacks[(source, target)] = reaction
 
         if bidirectional:
-            self.use_callbacks[target + source] = reaction
+            self.use_callbacks[(target, source)] = reaction
             
         return self
     
     def object(self, name, description, actions):
-        self.objects.append(Object(name, description, actions))
+        if name in self.index:
+            raise Exception('More than one object named "%s"' % name)
+        object = Object(name, description, actions, self.world.object_ids.intern(name))
+        self.objects.append(object)
+        self.index[name] = object
+        self.vocabulary.add(object.tokenize(), name)
+        self.world.vocabulary_changed()
         return self
 
-    def notify(self, action_name, source_object, target_object):
+    def notify(self, game, action_name, source_object, target_object):
         result = None
         notified = False
         objects = [source_object, target_object]
 
         if action_name == 'use' and source_object and target_object:
-            use_key = source_object.name + target_object.name            
+            use_key = (source_object.id, target_object.id)
             if use_key in self.use_callbacks:
-                result = self.game.exec_reaction(self.use_callbacks[use_key], source_object, target_object)
+                result = game.exec_reaction(self.use_callbacks[use_key], source_object, target_object)
                 notified = True
                 
         for object in objects:
@@ -128,68 +355,65 @@ class Objects:
                 continue
             
             if action_name in object.callbacks:
-                result = self.game.exec_reaction(object.callbacks[action_name], source_object, target_object)
+                result = game.exec_reaction(object.callbacks[action_name], source_object, target_object)
                 notified = True
                 break;
 
         return (notified, result)
 
     def get(self, name):
-        matches = list(filter(lambda x: x.name == name, self.objects))
-        if len(matches) > 1:
-            raise Exception('More than one object named "%s"' % name)
-        return matches[0] if len(matches) > 0 else None
+        return self.index.get(name)
 
-    def eat(self, tokens):
-        match_tokens = eat(map(lambda x: x.tokenize(), self.enumerate()), tokens)
-        return ' '.join(match_tokens) if match_tokens else None
+    def eat(self, tokens, typos=False):
+        return self.vocabulary.eat(tokens, typos)
     
     def enumerate(self):
         return sorted(self.objects, key=lambda x: len(x.name), reverse=True)
 
     def on(self, object_name, action_name, reaction):
-        self.get(object_name).on(action_name, reaction)
+        self.get(object_name).on(action_name, self.world.compile(reaction))
         return self
 
 class Actions:
-    def __init__(self, game):
+    def __init__(self, world):
         self.actions = []
         self.stops = ['in', 'on', 'the', 'with', 'to']
         self.reactions = {}
-        self.game = game
+        self.world = world
+        self.vocabulary = Vocabulary()
 
     def action(self, name, *aliases):
         if aliases and type(aliases[-1]) != str:
-            self.reactions[name] = aliases[-1]
+            self.reactions[name] = self.world.compile(aliases[-1])
             aliases = aliases[:-1]
-        self.actions.append(list(map(str.split, [name] + list(aliases))))
+        action = list(map(str.split, [name] + list(aliases)))
+        self.actions.append(action)
+        for alias in action:
+            self.vocabulary.add(alias, ' '.join(action[0]))
+        self.world.vocabulary_changed()
         return self
 
     def on(self, name, reaction):
-        self.reactions[name] = reaction
+        self.reactions[name] = self.world.compile(reaction)
 
     def has_reaction(self, name):
         return name in self.reactions
 
     def stop_words(self, *words):
         self.stops = words
+        self.world.vocabulary_changed()
         return self
 
     def eat_stop_words(self, tokens):
         while tokens and tokens[0] in self.stops:
             tokens.pop(0)
 
-    def eat(self, tokens):
-        actions = self.enumerate()
-        for action in actions:
+    def eat(self, tokens, typos=False):
+        self.eat_stop_words(tokens)
+        action = self.vocabulary.eat(tokens, typos)
+        if action:
             self.eat_stop_words(tokens)
-
-            if list_startswith(action, tokens):
-                for x in range(len(action)):
-                    tokens.pop(0)
-                    
-                self.eat_stop_words(tokens)
-                return self.canonicalize(action)
+        return action
 
     def enumerate(self):
         all_actions = []
@@ -201,9 +425,7 @@ class Actions:
     def canonicalize(self, name):
         if type(name) == str:
             name = name.split(' ')
-        for action in self.actions:
-            if name in action:
-                return ' '.join(action[0])
+        return self.vocabulary.get(name)
 
 class Result:
     def __init__(self, succeed=True, message='', silence=True, side_effect=None):
@@ -243,8 +465,106 @@ def succeed(message='', silence=True):
     '''
     return Result(True, message, silence)
 
-class Game:
+class CompiledResult:
+    __slots__ = ('result',)
+
+    def __init__(self, result):
+        self.result = result
+
+    def __call__(self, game, source_object, target_object):
+        return self.result
+
+class CompiledSideEffect:
+    __slots__ = ('side_effect',)
+
+    def __init__(self, side_effect):
+        self.side_effect = side_effect
+
+    def __call__(self, game, source_object, target_object):
+        profiler = game.profiler
+        if profiler:
+            profiler.enter(self.side_effect)
+        self.side_effect.call(game,
+                              source_object.name if source_object else None,
+                              target_object.name if target_object else None)
+        if profiler:
+            profiler.exit()
+
+class CompiledProgn:
+    __slots__ = ('statements',)
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __call__(self, game, source_object, target_object):
+        result = None
+        for statement in self.statements:
+            result = statement(game, source_object, target_object)
+        return result
+
+class CompiledCond:
+    __slots__ = ('check', 'args', 'then_part', 'else_part')
+
+    def __init__(self, check, args, then_part, else_part):
+        self.check = check
+        self.args = args
+        self.then_part = then_part
+        self.else_part = else_part
+
+    def __call__(self, game, source_object, target_object):
+        if self.check(game, *self.args):
+            return self.then_part(game, source_object, target_object)
+        return self.else_part(game, source_object, target_object)
+
+def compile_reaction(reaction, checks, later=None):
+    '''
+    Turns a reaction tree (cond/progn/predicates/side effects/results) into
+    a callable taking (game, source_object, target_object), with predicates
+    resolved up front. Raises if the tree uses an unknown predicate.
+
+    Reactions that side effects run later (see SideEffect.compile) are
+    compiled by `later`, or the same way as this one if None.
+    '''
+    def compile(statement):
+        return compile_reaction(statement, checks, later)
+
+    if reaction == None or type(reaction) == Result:
+        return CompiledResult(reaction)
+    if isinstance(reaction, SideEffect):
+        return CompiledSideEffect(reaction.compile(later or compile))
+    if type(reaction) == Progn:
+        statements = []
+        for statement in map(compile, reaction.statements):
+            # nested progns run in the same order when inlined
+            if type(statement) == CompiledProgn and statement.statements:
+                statements.extend(statement.statements)
+            else:
+                statements.append(statement)
+        return CompiledProgn(tuple(statements))
+    if type(reaction) == Cond:
+        if type(reaction.condition) != Predicate:
+            raise Exception('Unknown condition')
+        if reaction.condition.name not in checks:
+            raise Exception('Unknown predicate "%s"' % reaction.condition.name)
+        return CompiledCond(checks[reaction.condition.name],
+                            reaction.condition.args,
+                            compile(reaction.then_part),
+                            compile(reaction.else_part))
+    if callable(reaction):
+        return reaction
+    raise Exception('Unknown reaction %r' % reaction)
+
+class World:
+    '''
+    The definition of a game: its rooms, objects, actions, directions and
+    how the character starts out. A world can be shared by any number of
+    games once it is frozen, each game only keeping its own `State`.
+    '''
     def __init__(self):
+        # games keep these numbers in place of room and object names
+        self.room_ids = Names()
+        self.object_ids = Names()
+
         self.rooms = Rooms(self)
         self.character = Character(self)
         self.objects = Objects(self)
@@ -254,46 +574,824 @@ class Game:
         self.go_action_name = 'go'
         self.look_action_name = 'look'
         self.take_action_name = 'take'
+        self.undo_action_name = 'undo'
+        self.redo_action_name = 'redo'
+
+        # name -> check(game, *args), see `predicate`
+        self.predicates = dict(predicates.checks)
+
+        # the reactions side effects run later, like after_turns, and their
+        # numbers, so snapshots can say which one a timer runs
+        self.later = []
+        self.later_numbers = {}
+
+        self.typos = False
 
-        self.visited_rooms = set()
+        # command, with its spacing normalized -> Command, shared by every
+        # game of the world
+        self.parses = Cache(1024)
+        self.parse_hits = 0
+        self.parse_misses = 0
+
+        self.frozen = False
+
+    def freeze(self):
+        '''
+        Stops any more configuration of the world, so games can share it
+        '''
+        self.frozen = True
+        return self
+
+    def configure(self, part):
+        if self.frozen:
+            raise Exception('The world is frozen and can no longer be configured')
+        return part
+
+    def set_go_action_name(self, action_name):
+        self.configure(self).go_action_name = action_name
+        # rooms are only parsed after the go action
+        self.vocabulary_changed()
+
+    def set_look_action_name(self, action_name):
+        self.configure(self).look_action_name = action_name
+
+    def set_take_action_name(self, action_name):
+        self.configure(self).take_action_name = action_name
+
+    def set_undo_action_name(self, action_name):
+        self.configure(self).undo_action_name = action_name
+
+    def set_redo_action_name(self, action_name):
+        self.configure(self).redo_action_name = action_name
+
+    def configure_directions(self):
+        return self.configure(self.directions)
+
+    def configure_rooms(self):
+        return self.configure(self.rooms)
+
+    def configure_character(self):
+        return self.configure(self.character)
+
+    def configure_objects(self):
+        return self.configure(self.objects)
+
+    def configure_actions(self):
+        return self.configure(self.actions)
+
+    def predicate(self, name, check, reads=None):
+        '''
+        Lets conds use `Predicate(name, *args)`, which is true when
+        `check(game, *args)` is. If `reads` names every fact of the game's
+        state the check depends on (see predicates.facts), each game keeps
+        the check's results until one of those facts changes.
+
+        Only predicates registered before the reactions using them are
+        compiled are used by those reactions.
+        '''
+        if reads != None:
+            unknown = set(reads) - set(predicates.facts)
+            if unknown:
+                raise Exception('Unknown facts %s' % ', '.join(sorted(unknown)))
+            check = predicates.CachedCheck(name, check, reads)
+        self.configure(self).predicates[name] = check
+        return self
+
+    def compile(self, reaction):
+        return compile_reaction(reaction, self.predicates, self.compile_later)
+
+    def compile_later(self, reaction):
+        compiled = compile_reaction(reaction, self.predicates, self.compile_later)
+        self.later_numbers[compiled] = len(self.later)
+        self.later.append(compiled)
+        return compiled
+
+    def allow_typos(self):
+        '''
+        Lets commands with a typo in an action, object or direction be
+        understood, at the cost of an index of every word in them
+        '''
+        self.configure(self).typos = True
+        self.actions.vocabulary.allow_typos()
+        self.objects.vocabulary.allow_typos()
+        self.directions.vocabulary.allow_typos()
+        self.vocabulary_changed()
+        return self
+
+    def vocabulary_changed(self):
+        '''
+        Forgets every parse, as the words they were parsed with changed
+        '''
+        if self.parses:
+            self.parses = Cache(self.parses.limit)
+
+    def parse(self, string, profiler=None):
+        '''
+        Parses a command, reusing the parse of the same command from any
+        game of this world
+        '''
+        key = ' '.join(string.split())
+        command = self.parses.use(key)
+        if command == None:
+            self.parse_misses += 1
+            command = self.parses.keep(key, self.read(key, profiler))
+        else:
+            self.parse_hits += 1
+        return command
+
+    def read(self, string, profiler=None):
+        '''
+        Parses a command with its spacing normalized, see `parse`. If typos
+        are allowed and some words were not understood, it is parsed again
+        correcting typos, which is used if it understands more words.
+        '''
+        command = self.read_tokens(string.split(' '), profiler)
+        if self.typos and command.tokens:
+            corrected = self.read_tokens(string.split(' '), profiler, True)
+            if len(corrected.tokens) < len(command.tokens):
+                return corrected
+        return command
+
+    def read_tokens(self, tokens, profiler=None, typos=False):
+        if profiler:
+            profiler.enter('actions.eat')
+        action = self.actions.eat(tokens, typos)
+        if profiler:
+            profiler.switch('objects.eat')
+        source = self.objects.eat(tokens, typos)
+
+        # for "use key on door":
+        # "key" is source object
+        # "door" is target object
+        self.actions.eat_stop_words(tokens)
+        target = self.objects.eat(tokens, typos)
+        
+        if profiler:
+            profiler.switch('directions.eat')
+        direction = self.directions.eat(tokens, typos)
+
+        # for "go to bathroom"
+        room = None
+        if action == self.go_action_name and not direction:
+            room = self.rooms.eat(tokens)
+
+        if profiler:
+            profiler.exit()
+        return Command(action, source, target, direction, tuple(tokens), room)
+
+class Command:
+    '''
+    A parsed command. `tokens` are whatever could not be understood.
+    '''
+    __slots__ = ('action', 'source', 'target', 'direction', 'tokens', 'room')
+
+    def __init__(self, action, source, target, direction, tokens, room=None):
+        self.action = action
+        self.source = source
+        self.target = target
+        self.direction = direction
+        self.tokens = tokens
+        self.room = room
+
+class CommandResult:
+    '''
+    What running one command did: the messages it printed and the changes
+    it made to the game's state, as (method name, *arguments) tuples
+    '''
+    __slots__ = ('string', 'command', 'succeeded', 'messages', 'changes')
+
+    def __init__(self, string, command, succeeded, messages, changes):
+        self.string = string
+        self.command = command
+        self.succeeded = succeeded
+        self.messages = messages
+        self.changes = changes
+
+def has_bit(bits, id):
+    return (id >> 3) < len(bits) and bits[id >> 3] >> (id & 7) & 1 == 1
+
+def clear_bit(bits, id):
+    if (id >> 3) < len(bits):
+        bits[id >> 3] &= ~(1 << (id & 7)) & 0xff
+
+def set_bit(bits, id):
+    '''
+    Sets a bit in a bytearray, growing it as needed. Returns whether the
+    bit was not already set.
+    '''
+    if (id >> 3) >= len(bits):
+        bits.extend(bytes((id >> 3) + 1 - len(bits)))
+    bit = 1 << (id & 7)
+    if bits[id >> 3] & bit:
+        return False
+    bits[id >> 3] |= bit
+    return True
+
+# the kinds of change that take each other back
+opposites = {
+    'add_to_inventory': 'remove_from_inventory',
+    'remove_from_inventory': 'add_to_inventory',
+    'add_room_object': 'remove_room_object',
+    'remove_room_object': 'add_room_object',
+    'visit': 'unvisit',
+    'unvisit': 'visit',
+    'schedule': 'unschedule',
+    'unschedule': 'schedule'
+}
+
+# the fact each kind of change changes
+changed_facts = {
+    'add_to_inventory': 'inventory',
+    'remove_from_inventory': 'inventory',
+    'add_room_object': 'room_objects',
+    'remove_room_object': 'room_objects',
+    'change_description': 'descriptions',
+    'move_to': 'room',
+    'visit': 'visited',
+    'unvisit': 'visited',
+    # timers are not facts predicates read
+    'schedule': None,
+    'unschedule': None
+}
+
+def inverse(change):
+    '''
+    The change that takes back a change recorded by `Game.record`
+    '''
+    kind = change[0]
+    if kind in opposites:
+        return (opposites[kind],) + change[1:]
+    if kind == 'change_description':
+        return (kind, change[1], change[3], change[2])
+    if kind == 'move_to':
+        return (kind, change[2], change[1])
+    raise Exception('Unknown change %r' % (change,))
+
+class State:
+    '''
+    Everything that changes while playing a world. Rooms and objects are
+    only copied in here once they are changed, and are kept by their ids
+    in the world's `room_ids` and `object_ids`.
+    '''
+    __slots__ = ('room', 'inventory', 'visited', 'room_objects', 'descriptions')
+
+    def __init__(self, room=None):
+        # room id
+        self.room = room
+        # object ids
+        self.inventory = Bag()
+        # a bit per room id, set once the room is visited
+        self.visited = bytearray()
+        # room id -> object ids, for the rooms whose objects have changed
+        self.room_objects = {}
+        # object id -> description, for changed descriptions
+        self.descriptions = {}
+
+    def copy(self):
+        state = State(self.room)
+        state.inventory = self.inventory.copy()
+        state.visited = bytearray(self.visited)
+        state.room_objects = dict((room, self.room_objects[room].copy()) for room in self.room_objects)
+        state.descriptions = self.descriptions.copy()
+        return state
+
+class Game:
+    def __init__(self, world=None, sink=None):
+        self.world = world if world != None else World()
+        self._state = None
+
+        self.sink = sink if sink != None else FileSink()
+        # what the current command has printed and changed so far
+        self.buffer = None
+        self.changes = None
+
+        self.profiler = None
+        self.journal = None
+
+        # the changes of the last commands that changed anything, and of
+        # the commands undone since, when keeping a history
+        self.undos = None
+        self.redos = []
+
+        # how many commands have run, and the reactions waiting for a
+        # turn, made on first use
+        self.turn = 0
+        self.timers = None
+        # a Scheduler for the wall clock, shared with other games
+        self.clock = None
+
+        # (CachedCheck, args) -> result, and fact -> the set of keys whose
+        # results read it
+        self.checks = None
+        self.readers = None
+
+        # room id -> the line about its objects, for rooms whose objects
+        # this game changed
+        self.rendered = None
 
         self.silence = False
 
+    @property
+    def state(self):
+        # made on first use so the world can be configured after `Game()`
+        if self._state == None:
+            start_room = self.world.character.start_room
+            self._state = State(None if start_room == None else self.world.room_ids.intern(start_room))
+        return self._state
+
+    @property
+    def rooms(self):
+        return self.world.rooms
+
+    @property
+    def character(self):
+        return self.world.character
+
+    @property
+    def objects(self):
+        return self.world.objects
+
+    @property
+    def actions(self):
+        return self.world.actions
+
+    @property
+    def directions(self):
+        return self.world.directions
+
+    @property
+    def room(self):
+        room = self.state.room
+        return None if room == None else self.world.room_ids.names[room]
+
+    @property
+    def visited_rooms(self):
+        names = self.world.room_ids.names
+        visited = self.state.visited
+        return set(names[(i << 3) + bit] for i in range(len(visited)) if visited[i]
+                   for bit in range(8) if visited[i] >> bit & 1)
+
     def set_go_action_name(self, action_name):
-        self.go_action_name = action_name
+        self.world.set_go_action_name(action_name)
 
     def set_look_action_name(self, action_name):
-        self.look_action_name = action_name
+        self.world.set_look_action_name(action_name)
 
     def set_take_action_name(self, action_name):
-        self.take_action_name = action_name
+        self.world.set_take_action_name(action_name)
+
+    def set_undo_action_name(self, action_name):
+        self.world.set_undo_action_name(action_name)
+
+    def set_redo_action_name(self, action_name):
+        self.world.set_redo_action_name(action_name)
+
+    def allow_typos(self):
+        self.world.allow_typos()
+        return self
 
     def print(self, *message):
         if not self.silence:
-            print(*message)
+            text = ' '.join(map(str, message))
+            if self.buffer != None:
+                self.buffer.append(text)
+            else:
+                self.sink.write(text + '\n')
+
+    def set_sink(self, sink):
+        self.sink = sink
+        return self
+
+    def set_journal(self, journal):
+        '''
+        Logs every command to the journal before running it
+        '''
+        self.journal = journal
+        return self
+
+    def set_history(self, depth):
+        '''
+        Keeps what the last `depth` commands that changed anything changed,
+        so they can be undone, or stops keeping it if 0
+        '''
+        self.undos = collections.deque(maxlen=depth) if depth else None
+        self.redos = []
+        return self
+
+    def set_clock(self, clock):
+        '''
+        Lets reactions be run after a number of seconds, by the Scheduler
+        `clock` (or stops them if None)
+        '''
+        self.clock = clock
+        return self
+
+    def after_turns(self, turns, reaction, source_object=None, target_object=None):
+        '''
+        Runs a reaction at the end of the command `turns` commands after
+        this one. Returns a Timer that can be cancelled. Undoing the
+        command cancels the timer, and redoing it starts it over.
+        '''
+        if self.timers == None:
+            self.timers = Scheduler()
+        timer = self.timers.at(self.turn + turns, self, reaction, source_object, target_object)
+        self.record('schedule', turns, timer)
+        return timer
+
+    def after_seconds(self, seconds, reaction, source_object=None, target_object=None):
+        '''
+        Runs a reaction once `seconds` have passed, when the clock is next
+        run. Returns a Timer that can be cancelled.
+        '''
+        if self.clock == None:
+            raise Exception('The game has no clock, see set_clock')
+        return self.clock.at(self.clock.now() + seconds, self, reaction, source_object, target_object)
+
+    def run_timer(self, timer):
+        timer.ran = True
+        result = self.exec_reaction(timer.reaction, timer.source, timer.target)
+        if result and result.message:
+            self.print(result.message)
+
+    def set_profiler(self, profiler):
+        '''
+        Times each command with the profiler, or stops timing if None
+        '''
+        self.profiler = profiler
+        return self
 
     def configure_directions(self):
-        return self.directions
+        return self.world.configure_directions()
 
     def configure_rooms(self):
-        return self.rooms
+        return self.world.configure_rooms()
 
     def configure_character(self):
-        return self.character
+        return self.world.configure_character()
 
     def configure_objects(self):
-        return self.objects
+        return self.world.configure_objects()
 
     def configure_actions(self):
-        return self.actions
+        return self.world.configure_actions()
+
+    def compile(self, reaction):
+        return self.world.compile(reaction)
+
+    def get_inventory(self):
+        names = self.world.object_ids.names
+        return [names[id] for id in self.state.inventory]
+
+    def inventory_has(self, object):
+        return self.world.object_ids.get(object) in self.state.inventory
+
+    def cached_check(self, check, args):
+        key = (check, args)
+        checks = self.checks
+        if checks == None:
+            checks = self.checks = {}
+            self.readers = {}
+        elif key in checks:
+            return checks[key]
+        result = checks[key] = check.check(self, *args)
+        readers = self.readers
+        for fact in check.reads:
+            if fact in readers:
+                readers[fact].add(key)
+            else:
+                readers[fact] = {key}
+        return result
 
-    def exec_reaction(self, reaction, source_object=None, target_object=None):
-        preds = {
-            'inventory_has': lambda object: object in self.character.inventory,
-            'in_room': lambda room: room == self.character.room,
-            'has_visited': lambda room: room in self.visited_rooms
-        }
+    def dirty(self, fact):
+        '''
+        Forgets the predicate results that read a fact, as it changed
+        '''
+        if self.checks:
+            readers = self.readers
+            keys = readers.pop(fact, None)
+            if keys:
+                checks = self.checks
+                for key in keys:
+                    del checks[key]
+                    # the other facts it read no longer need to forget it
+                    for other in key[0].reads:
+                        if other != fact:
+                            readers[other].discard(key)
+
+    def forget_checks(self):
+        self.checks = None
+        self.readers = None
+
+    def record(self, *change):
+        if self.changes != None:
+            self.changes.append(change)
+
+    def add_to_inventory(self, object, force=False):
+        inventory = self.state.inventory
+        limit = self.character.inventory_limit
+        if force or limit == None or len(inventory) + 1 <= limit:
+            inventory.add(self.world.object_ids.intern(object))
+            self.dirty('inventory')
+            self.record('add_to_inventory', object)
+            return True
+        else:
+            return False
+
+    def remove_from_inventory(self, object):
+        id = self.world.object_ids.get(object)
+        if id not in self.state.inventory:
+            raise ValueError('%r is not in the inventory' % object)
+        self.state.inventory.remove(id)
+        self.dirty('inventory')
+        self.record('remove_from_inventory', object)
+
+    def get_room_objects(self, room_name):
+        objects = self.state.room_objects.get(self.world.room_ids.get(room_name))
+        if objects == None:
+            return self.rooms.get(room_name).objects
+        names = self.world.object_ids.names
+        return [names[id] for id in objects]
+
+    def edit_room_objects(self, room_name):
+        '''
+        This game's own copy of the ids of the objects in a room, to be
+        changed
+        '''
+        room = self.world.room_ids.intern(room_name)
+        room_objects = self.state.room_objects
+        if room not in room_objects:
+            object_ids = self.world.object_ids
+            room_objects[room] = Bag(map(object_ids.intern, self.rooms.get(room_name).objects))
+        return room_objects[room]
+
+    def room_has(self, room_name, object):
+        objects = self.state.room_objects.get(self.world.room_ids.get(room_name))
+        if objects == None:
+            return object in self.rooms.get(room_name).objects
+        return self.world.object_ids.get(object) in objects
+
+    def add_room_object(self, room_name, object):
+        self.edit_room_objects(room_name).add(self.world.object_ids.intern(object))
+        self.forget_render(room_name)
+        self.dirty('room_objects')
+        self.record('add_room_object', room_name, object)
+
+    def remove_room_object(self, room_name, object):
+        objects = self.edit_room_objects(room_name)
+        id = self.world.object_ids.get(object)
+        if id not in objects:
+            raise ValueError('%r is not in the %s' % (object, room_name))
+        objects.remove(id)
+        self.forget_render(room_name)
+        self.dirty('room_objects')
+        self.record('remove_room_object', room_name, object)
+
+    def get_description(self, object):
+        return self.state.descriptions.get(self.world.object_ids.intern(object.name), object.description)
+
+    def change_description(self, object_name, description):
+        id = self.world.object_ids.intern(object_name)
+        descriptions = self.state.descriptions
+        self.record('change_description', object_name, descriptions.get(id), description)
+        descriptions[id] = description
+        self.dirty('descriptions')
+
+    def snapshot(self, turn=True):
+        '''
+        This game's state as bytes, see snapshot.py. Names are written
+        instead of ids, so snapshots still load after the world changes.
+        Rooms changed back to how the world has them are left out, so
+        equal states give equal bytes.
+
+        The turn and the timers waiting for a turn are kept, timers by the
+        number the world gave their reaction when compiling it, so they
+        only load into the same world. So is the undo history, if the game
+        keeps one. Raises if a timer runs a reaction
+        the world did not compile (see `can_snapshot`). Timers on the
+        clock are not kept. With `turn` False the turn is written as 0, for
+        comparing states however many commands led to them.
+        '''
+        state = self.state
+        rooms = self.world.room_ids.names
+        objects = self.world.object_ids.names
+
+        def counts(bag):
+            return dict((objects[id], bag.counts[id]) for id in bag.counts)
+        room_objects = {}
+        for room in state.room_objects:
+            changed = counts(state.room_objects[room])
+            if changed != self.rooms.get(rooms[room]).objects.counts:
+                room_objects[rooms[room]] = changed
+        if not self.can_snapshot():
+            raise Exception('The game can not be snapshot while it has a timer, waiting or '
+                            'in its history, running a reaction the world did not compile')
+        numbers = self.world.later_numbers
+        def name(object):
+            return None if object == None else object.name
+        # timer -> its number in the snapshot + 1
+        pending = {}
+        timers = []
+        for timer, turns in self.pending_timers():
+            timers.append((turns, numbers[timer.reaction], name(timer.source), name(timer.target)))
+            pending[timer] = len(timers)
+
+        def history(commands):
+            return [[change if change[0] != 'schedule' else
+                     ('schedule', change[1], numbers[change[2].reaction], name(change[2].source),
+                      name(change[2].target), change[2].ran, pending.get(change[2], 0))
+                     for change in changes]
+                    for changes in commands]
+        return snapshot.dumps(self.room, counts(state.inventory), self.visited_rooms, room_objects,
+                              dict((objects[id], state.descriptions[id]) for id in state.descriptions),
+                              self.turn if turn else 0, timers,
+                              history(self.undos or ()), history(self.redos))
+
+    def pending_timers(self):
+        '''
+        (timer, turns left) for the timers waiting for a turn, in the
+        order they will run
+        '''
+        if not self.timers:
+            return []
+        return [(timer, when - self.turn) for (when, timer) in self.timers.waiting()]
+
+    def can_snapshot(self):
+        '''
+        Whether every timer waiting or in the undo history runs a reaction
+        the world compiled, so the game can be snapshot
+        '''
+        numbers = self.world.later_numbers
+        timers = [timer for timer, turns in self.pending_timers()]
+        for history in (self.undos or (), self.redos):
+            for changes in history:
+                timers += [change[2] for change in changes if change[0] == 'schedule']
+        return all(timer.reaction in numbers for timer in timers)
+
+    def restore(self, data):
+        '''
+        Puts back the state from `snapshot`, with its undo history if this
+        game keeps one (see `set_history`)
+        '''
+        room_ids = self.world.room_ids
+        object_ids = self.world.object_ids
+        room, inventory, visited_rooms, room_objects, descriptions, turn, timers, undos, redos = \
+            snapshot.loads(data)
+        later = self.world.later
+        for turns, reaction, source, target in timers:
+            if reaction >= len(later):
+                raise Exception('The snapshot has a timer for a reaction this world does not have')
+
+        def bag(counts):
+            return Bag.from_counts(dict((object_ids.intern(name), counts[name]) for name in counts))
+        self._state = State(None if room == None else room_ids.intern(room))
+        state = self.state
+        state.inventory = bag(inventory)
+        for room in visited_rooms:
+            set_bit(state.visited, room_ids.intern(room))
+        state.room_objects = dict((room_ids.intern(room), bag(room_objects[room])) for room in room_objects)
+        state.descriptions = dict((object_ids.intern(name), descriptions[name]) for name in descriptions)
+        self.turn = turn
+        self.timers = None
+        timers = [self.after_turns(turns, later[reaction], self.objects.get(source), self.objects.get(target))
+                  for turns, reaction, source, target in timers]
+
+        def history(commands):
+            for changes in commands:
+                for i, change in enumerate(changes):
+                    if change[0] == 'schedule':
+                        turns, reaction, source, target, ran, number = change[1:]
+                        if reaction >= len(later):
+                            raise Exception('The snapshot has a timer for a reaction this world does not have')
+                        if number:
+                            timer = timers[number - 1]
+                        else:
+                            timer = Timer(self, later[reaction], self.objects.get(source), self.objects.get(target))
+                            timer.cancelled = True
+                            timer.ran = ran
+                        changes[i] = ('schedule', turns, timer)
+            return commands
+        # the changes kept for undo were made to the state just replaced
+        if self.undos != None:
+            self.undos.clear()
+            self.undos.extend(history(undos))
+            self.redos = history(redos)
+        else:
+            self.redos = []
+        self.forget_checks()
+        self.rendered = None
+        return self
+
+    def fork(self):
+        '''
+        A new game of the same world, starting out where this one is
+        '''
+        game = Game(self.world, self.sink)
+        game._state = self.state.copy()
+        game.turn = self.turn
+        for timer, turns in self.pending_timers():
+            game.after_turns(turns, timer.reaction, timer.source, timer.target)
+        return game
+
+    def has_visited(self, room_name):
+        id = self.world.room_ids.get(room_name)
+        return id != None and has_bit(self.state.visited, id)
+
+    def move_to(self, room_name):
+        self.record('move_to', self.room, room_name)
+        self.state.room = self.world.room_ids.intern(room_name)
+        self.dirty('room')
+
+    def visit(self, room_name):
+        if set_bit(self.state.visited, self.world.room_ids.intern(room_name)):
+            self.dirty('visited')
+            self.record('visit', room_name)
+
+    def apply(self, change):
+        '''
+        Makes a change like the ones passed to `record` again, without
+        recording it
+        '''
+        kind = change[0]
+        state = self.state
+        object_ids = self.world.object_ids
+        room_ids = self.world.room_ids
+        if kind == 'add_to_inventory':
+            state.inventory.add(object_ids.intern(change[1]))
+        elif kind == 'remove_from_inventory':
+            state.inventory.remove(object_ids.get(change[1]))
+        elif kind == 'add_room_object':
+            self.edit_room_objects(change[1]).add(object_ids.intern(change[2]))
+            self.forget_render(change[1])
+        elif kind == 'remove_room_object':
+            self.edit_room_objects(change[1]).remove(object_ids.get(change[2]))
+            self.forget_render(change[1])
+        elif kind == 'change_description':
+            if change[3] == None:
+                state.descriptions.pop(object_ids.intern(change[1]), None)
+            else:
+                state.descriptions[object_ids.intern(change[1])] = change[3]
+        elif kind == 'move_to':
+            state.room = room_ids.intern(change[2])
+        elif kind == 'visit':
+            set_bit(state.visited, room_ids.intern(change[1]))
+        elif kind == 'unvisit':
+            clear_bit(state.visited, room_ids.intern(change[1]))
+        elif kind == 'schedule':
+            # what a timer that already ran did is part of the command it
+            # ran in, so it is not started again
+            if not change[2].ran:
+                if self.timers == None:
+                    self.timers = Scheduler()
+                self.timers.again(change[2], self.turn + change[1])
+        elif kind == 'unschedule':
+            change[2].cancel()
+        else:
+            raise Exception('Unknown change %r' % (change,))
+        if changed_facts[kind]:
+            self.dirty(changed_facts[kind])
+
+    def undo(self):
+        '''
+        Takes back the last command that changed anything. Returns whether
+        there was one.
+        '''
+        if not self.undos:
+            return False
+        changes = self.undos.pop()
+        for change in reversed(changes):
+            self.apply(inverse(change))
+        self.redos.append(changes)
+        return True
 
+    def redo(self):
+        '''
+        Makes the last undone command's changes again. Returns whether
+        there was one.
+        '''
+        if not self.redos:
+            return False
+        changes = self.redos.pop()
+        for change in changes:
+            self.apply(change)
+        self.undos.append(changes)
+        return True
+
+    def exec_reaction(self, reaction, source_object=None, target_object=None):
+        profiler = self.profiler
+        if profiler:
+            profiler.enter(reaction)
+            try:
+                return self.interpret(reaction, source_object, target_object)
+            finally:
+                profiler.exit()
+        return self.interpret(reaction, source_object, target_object)
+
+    def interpret(self, reaction, source_object=None, target_object=None):
+        if callable(reaction):
+            return reaction(self, source_object, target_object)
+
+        # reactions that were not registered through the configure_* api
+        # are interpreted as they are
         source = None if not source_object else source_object.name
         target = None if not target_object else target_object.name
 
@@ -305,74 +1403,107 @@ class Game:
         if type(reaction) == Cond:
             was_true = False
             if type(reaction.condition) == Predicate:
-                was_true = preds[reaction.condition.name](*reaction.condition.args)
+                was_true = self.world.predicates[reaction.condition.name](self, *reaction.condition.args)
             else:
                 raise Exception('Unknown condition')
             if was_true:
-                return self.exec_reaction(reaction.then_part, source_object, target_object)
+                return self.interpret(reaction.then_part, source_object, target_object)
             else:
-                return self.exec_reaction(reaction.else_part, source_object, target_object)
+                return self.interpret(reaction.else_part, source_object, target_object)
         if isinstance(reaction, SideEffect):
+            if self.profiler:
+                self.profiler.enter(reaction)
             reaction.call(self, source, target)
+            if self.profiler:
+                self.profiler.exit()
         elif type(reaction) == Progn:
             last_result = None
             for statement in reaction.statements:
-                last_result = self.exec_reaction(statement, source_object, target_object)
+                last_result = self.interpret(statement, source_object, target_object)
             return last_result
         elif type(reaction) == Result:
             return reaction
 
     def in_room(self, room_name):
         def func():
-            return self.character.room == room_name
+            return self.room == room_name
         return func
 
-    def go(self, direction):
+    def fire(self, event, from_room, to_room):
+        '''
+        Runs the reactions to a move until one fails, returning the result
+        of the last one run
+        '''
+        result = None
+        for reaction in self.character.transitions.get(event, from_room, to_room):
+            if result and result.message:
+                self.print(result.message)
+            result = self.exec_reaction(reaction)
+            if result and not result.succeed:
+                break
+        return result
+
+    def travel(self, room_name):
+        '''
+        Walks the character to a room the shortest way, stopping if a room
+        won't let them through. Returns whether they got there.
+        '''
+        if room_name == self.room:
+            self.print('You are already in the %s.' % room_name)
+            return True
+
+        directions = self.rooms.route(self.room, room_name)
+        if directions == None:
+            self.print('You don\'t know a way to the %s.' % room_name)
+            return False
+
+        for i in range(len(directions)):
+            room = self.room
+            self.go(directions[i], look=i == len(directions) - 1)
+            if self.room == room:
+                return False
+        return True
+
+    def go(self, direction, look=True):
         '''
         Moves the character to a room in this direction
         '''
-        next_room = self.rooms.go(self.character.room, direction)
+        next_room = self.rooms.go(self.room, direction)
         if not next_room:
             self.print('You cannot go %s' % direction)
         else:
-            result = None
-            for room in self.character.room_enter_callbacks:
-                if room == next_room:
-                    result = self.exec_reaction(self.character.room_enter_callbacks[room])
-                    break;
+            result = self.fire('enter', self.room, next_room)
 
             if result and result.message:
                 self.print(result.message)
             if result and not result.succeed:
                 return
             
-            for room in self.character.room_exit_callbacks:
-                if room == self.character.room:
-                    result = self.exec_reaction(self.character.room_exit_callbacks[room])
-                    break;
+            result = self.fire('exit', self.room, next_room)
 
             if result and result.message:
                 self.print(result.message)
                 self.silence = result.silence                
             if not result or result.succeed:
-                self.character.room = next_room
-                self.print_room()
+                self.move_to(next_room)
+                if look:
+                    self.print_room()
 
-            self.visited_rooms.add(self.character.room)
+            self.visit(self.room)
             
             self.silence = False
 
     def is_in_room_or_inv(self, source_object, target_object):
-        room = self.rooms.get(self.character.room)
+        room = self.room
 
         source_not_found = False
         if source_object != None:
-            source_not_found = source_object.name not in room.objects and source_object.name not in self.character.inventory
+            source_not_found = not self.room_has(room, source_object.name) and not self.inventory_has(source_object.name)
 
 
         target_not_found = False            
         if target_object != None:
-            target_not_found = target_object.name not in room.objects and target_object.name not in self.character.inventory
+            target_not_found = not self.room_has(room, target_object.name) and not self.inventory_has(target_object.name)
 
         
         not_found = source_object if source_not_found else target_object
@@ -382,29 +1513,107 @@ class Game:
         return True
 
     def execute(self, string):
+        '''
+        Runs a command, writing everything it prints to the sink at once
+        '''
+        result = None
+        profiler = self.profiler
+        if profiler:
+            profiler.begin()
+        if self.journal:
+            self.journal.append(string)
+        try:
+            result = self.execute_command(string, self.world.parse(string, profiler))
+            if self.journal:
+                self.journal.executed(self)
+        finally:
+            messages = result.messages if result else self.buffer
+            self.buffer = None
+            if messages:
+                self.sink.write('\n'.join(messages) + '\n')
+        return result
+
+    def execute_many(self, commands):
+        '''
+        Runs each command in turn and returns a CommandResult for each,
+        without writing anything to the sink.
+
+        Each different command is parsed once for the whole batch, but
+        every command still runs its reactions on the state the ones
+        before it left. That is where the time goes, so this runs about
+        as fast per command as `execute` and is not a way to replay
+        transcripts many times faster.
+        '''
+        results = []
+        profiler = self.profiler
+        journal = self.journal
+        parse = self.world.parse
+        # command -> Command, for this batch
+        parsed = {}
+        for string in commands:
+            if profiler:
+                profiler.begin()
+            if journal:
+                journal.append(string)
+            command = parsed.get(string)
+            try:
+                if command == None:
+                    command = parsed[string] = parse(string, profiler)
+                results.append(self.execute_command(string, command))
+            finally:
+                self.buffer = None
+            if journal:
+                journal.executed(self)
+        return results
+
+    def execute_command(self, string, command):
+        self.buffer = []
+        self.changes = []
+        self.turn += 1
+        self.dirty('turn')
+        try:
+            succeeded = self.run(command)
+            if self.timers:
+                for timer in self.timers.due(self.turn):
+                    self.run_timer(timer)
+            if self.undos != None and self.changes:
+                self.undos.append(self.changes)
+                self.redos = []
+            return CommandResult(string, command, succeeded, self.buffer, self.changes)
+        finally:
+            self.changes = None
+            if self.profiler:
+                self.profiler.end(command.action)
+
+    def run(self, command):
+        '''
+        Does what a parsed command says, returning whether it worked
+        '''
         self.silence = False
         failed = False
 
-        room = self.rooms.get(self.character.room)
-        
-        tokens = re.split('\s+', string.strip())
-        
-        action = self.actions.eat(tokens)
-        source_object = self.objects.get(self.objects.eat(tokens))
-
-        # for "use key on door":
-        # "key" is source object
-        # "door" is target object
-        self.actions.eat_stop_words(tokens)
-        target_object = self.objects.get(self.objects.eat(tokens))
+        room = self.room
+        profiler = self.profiler
         
-        direction = self.directions.eat(tokens)
+        action = command.action
+        if profiler:
+            profiler.enter('objects.get')
+        source_object = self.objects.get(command.source)
+        target_object = self.objects.get(command.target)
+        if profiler:
+            profiler.exit()
+        direction = command.direction
+        tokens = command.tokens
 
         notified, reaction_result = (False, None)
         if self.is_in_room_or_inv(source_object, target_object):
-            notified, reaction_result = self.objects.notify(action, source_object, target_object)
+            if profiler:
+                profiler.enter('notify')
+            notified, reaction_result = self.objects.notify(self, action, source_object, target_object)
+            if profiler:
+                profiler.exit()
         else:
-            return
+            return False
 
         if tokens:
             failed = True
@@ -427,57 +1636,84 @@ class Game:
         elif action == 'use':
             if not source_object:
                 failed = True
-                print('Use what?')
+                self.print('Use what?')
             elif not target_object:
                 failed = True
-                print('Use %s on what?' % source_object)
+                self.print('Use %s on what?' % source_object)
             else:
-                if source_object.name not in self.character.inventory and target_object.name not in self.character.inventory:
+                if not self.inventory_has(source_object.name) and not self.inventory_has(target_object.name):
                     failed = True
-                    print('You don\'t have that')
+                    self.print('You don\'t have that')
                 else:
                     message = 'You use the %s on the %s' % (source_object, target_object)
                     if reaction_result:
                         if not reaction_result.succeed:
                             failed = True
-                            print('That didn\'t work.')
+                            self.print('That didn\'t work.')
                     else:
                         if self.is_in_room_or_inv(source_object, target_object):
-                            print('Nothing happens.')
-        elif action == self.go_action_name:
-            if not direction:
+                            self.print('Nothing happens.')
+        elif action == self.world.undo_action_name and not source_object:
+            if not self.undo():
+                failed = True
+                self.print('There is nothing to undo.')
+            else:
+                self.print('Undone.')
+                if self.room != room:
+                    self.print_room()
+        elif action == self.world.redo_action_name and not source_object:
+            if not self.redo():
+                failed = True
+                self.print('There is nothing to redo.')
+            else:
+                self.print('Redone.')
+                if self.room != room:
+                    self.print_room()
+        elif action == self.world.go_action_name:
+            if command.room:
+                if profiler:
+                    profiler.enter('go')
+                failed = not self.travel(command.room)
+                if profiler:
+                    profiler.exit()
+            elif not direction:
                 failed = True
                 self.print('You must give a valid direction to go')
             else:
+                if profiler:
+                    profiler.enter('go')
                 self.go(direction)
-        elif action == self.look_action_name:
+                if profiler:
+                    profiler.exit()
+        elif action == self.world.look_action_name:
             if not source_object:
                 self.print_room()
             else:
-                self.print(source_object.description)
-        elif action == self.take_action_name:
+                self.print(self.get_description(source_object))
+        elif action == self.world.take_action_name:
             if not source_object:
                 self.print('Take what?')
-            elif source_object.name in room.objects:
-                if self.character.add_to_inventory(source_object.name):
-                    print('You pick up the %s.' % source_object)
-                    room.objects.remove(source_object.name)
+            elif self.room_has(room, source_object.name):
+                if self.add_to_inventory(source_object.name):
+                    self.print('You pick up the %s.' % source_object)
+                    self.remove_room_object(room, source_object.name)
                 else:
                     failed = True
-                    print('Your inventory is out of room.')
+                    self.print('Your inventory is out of room.')
             else:
                 failed = True
                 self.print('There is no %s in here.' % source_object)
         elif action == 'drop':
-            if source_object and source_object.name in self.character.inventory:
-                room.objects.append(source_object.name)
-                self.character.inventory.remove(source_object.name)
+            if source_object and self.inventory_has(source_object.name):
+                self.add_room_object(room, source_object.name)
+                self.remove_from_inventory(source_object.name)
             else:
-                print('You don\'t have a %s.' % source_object)
+                self.print('You don\'t have a %s.' % source_object)
                 failed = True
         elif action == 'inventory':
-            if self.character.inventory:
-                self.print('You have:\n\t' + '\n\t'.join(map(lambda x: ('a ' + x).title(), self.character.inventory)))
+            inventory = self.get_inventory()
+            if inventory:
+                self.print('You have:\n\t' + '\n\t'.join(map(lambda x: ('a ' + x).title(), inventory)))
             else:
                 self.print('Your inventory is empty.')
         elif not notified:
@@ -486,83 +1722,272 @@ class Game:
 
         if reaction_result:
             if not failed and reaction_result and reaction_result.message:
-                print(reaction_result.message)
+                self.print(reaction_result.message)
             elif not reaction_result.succeed and not reaction_result.message:
-                print('That didn\'t work.')
+                self.print('That didn\'t work.')
+
+        return not failed
             
 
     def print_room(self):
-        room = self.rooms.get(self.character.room)
-        self.print(room.name.title())
-        self.print('\t', room.description)
-        adjacent_rooms = self.rooms.get_adjacent_rooms(self.character.room)
-
-        self.print()        
-        for direction in adjacent_rooms:
-            self.print('%s is to the %s.' % (adjacent_rooms[direction].title(), direction))
-
-        if room.objects:
-            objects = sorted(room.objects.copy())
-            if len(objects) > 1:
-                objects.insert(-1, 'and')
-                
-            self.print('There is a %s here.' % ', '.join(objects))
-            
+        if self.profiler:
+            self.profiler.enter('print_room')
+        text, objects = self.rooms.render(self.room)
+
+        room = self.state.room
+        if room in self.state.room_objects:
+            # this game changed what is in the room
+            rendered = self.rendered
+            if rendered == None:
+                rendered = self.rendered = {}
+            if room in rendered:
+                objects = rendered[room]
+            else:
+                objects = rendered[room] = describe_objects(self.get_room_objects(self.room))
+
+        self.print(text if objects == None else text + '\n' + objects)
+
+        if self.profiler:
+            self.profiler.exit()
+
+    def forget_render(self, room_name):
+        if self.rendered:
+            self.rendered.pop(self.world.room_ids.get(room_name), None)
+
+def describe_objects(objects):
+    '''
+    The line saying what objects are in a room, or None if there are none
+    '''
+    if not objects:
+        return None
+    objects = sorted(objects)
+    if len(objects) > 1:
+        objects.insert(-1, 'and')
+    return 'There is a %s here.' % ', '.join(objects)
+
+class Bag:
+    '''
+    A multiset of names, iterated in the order they were first added.
+    Adding, removing and `in` take constant time.
+    '''
+    __slots__ = ('counts', 'size')
+
+    def __init__(self, items=()):
+        self.counts = {}
+        self.size = 0
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        self.counts[item] = self.counts.get(item, 0) + 1
+        self.size += 1
+
+    def remove(self, item):
+        count = self.counts.get(item)
+        if not count:
+            raise ValueError('%r is not in the bag' % item)
+        if count == 1:
+            del self.counts[item]
+        else:
+            self.counts[item] = count - 1
+        self.size -= 1
+
+    @classmethod
+    def from_counts(cls, counts):
+        bag = cls()
+        bag.counts = counts
+        bag.size = sum(counts.values())
+        return bag
+
+    def copy(self):
+        return Bag.from_counts(self.counts.copy())
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for item, count in self.counts.items():
+            for i in range(count):
+                yield item
+
+    def __eq__(self, other):
+        return isinstance(other, Bag) and self.counts == other.counts
+
+    def __repr__(self):
+        return 'Bag(%r)' % list(self)
+
 class Room:
     def __init__(self, name, description='', objects=None):
         self.name = name
         self.description = description
-        self.objects = objects if objects != None else []
+        self.objects = Bag(objects if objects != None else ())
         self.connections = []
 
 class Rooms:
-    def __init__(self, game):
+    def __init__(self, world):
+        # room -> {direction: room}
         self.mappings = {}
+        # room -> [(room, direction)] of the ways into it
+        self.entrances = {}
         self.rooms = {}
-        self.game = game
+        self.vocabulary = Vocabulary()
+        # room -> {room: (distance, direction, next room)}, the shortest
+        # way to that room from every room that can reach it
+        self.routes = Cache(1024)
+        # room -> (how it looks apart from its objects, the line about the
+        # objects the world puts in it)
+        self.renders = Cache(10000)
+        self.world = world
 
     def room(self, name, description, objects=None, connections=None):
         self.rooms[name] = Room(name, description, objects)
+        self.renders.pop(name, None)
+        self.world.room_ids.intern(name)
+        for object in objects or ():
+            self.world.object_ids.intern(object)
+        self.vocabulary.add(name.split(' '), name)
+        self.world.vocabulary_changed()
         return self
     
     def map(self, from_room, direction, to_room, bidirectional=True):
-        if from_room not in self.mappings:
-            self.mappings[from_room] = []
-        if to_room not in self.mappings:
-            self.mappings[to_room] = []
-            
-        self.mappings[from_room].append((direction, to_room))
+        self.connect(from_room, direction, to_room)
         
         if bidirectional:
-            self.mappings[to_room].append((self.game.directions.get_opposite(direction), from_room))
+            self.connect(to_room, self.world.directions.get_opposite(direction), from_room)
 
         return self
 
+    def connect(self, from_room, direction, to_room):
+        direction = self.world.directions.canonicalize(direction) or direction
+        self.world.room_ids.intern(from_room)
+        self.world.room_ids.intern(to_room)
+        exits = self.mappings.setdefault(from_room, {})
+        self.mappings.setdefault(to_room, {})
+        # the first way mapped in a direction is the one taken
+        if direction in exits:
+            return
+        exits[direction] = to_room
+        self.entrances.setdefault(to_room, []).append((from_room, direction))
+        self.renders.pop(from_room, None)
+
+        # a new way can only make routes shorter, so routes that it does
+        # not shorten are still right
+        for destination in list(self.routes):
+            routes = self.routes[destination]
+            if to_room in routes and (from_room not in routes or routes[to_room][0] + 1 < routes[from_room][0]):
+                del self.routes[destination]
+
+    def use_store(self, store):
+        '''
+        Keeps the rooms in a store (like roomstore.RoomStore) instead of a
+        dict. Rooms already added are moved into it.
+        '''
+        for name in self.rooms:
+            store[name] = self.rooms[name]
+        for name in store:
+            self.world.room_ids.intern(name)
+            self.vocabulary.add(name.split(' '), name)
+        self.world.vocabulary_changed()
+        store.commit()
+        self.rooms = store
+        self.renders = Cache(self.renders.limit)
+        return self
+
     def get(self, room_name):
         return self.rooms[room_name]
 
+    def render(self, room_name):
+        '''
+        (the name, description and exits of a room, the line about the
+        objects the world puts in it or None), made once per room
+        '''
+        render = self.renders.use(room_name)
+        if render == None:
+            room = self.get(room_name)
+            lines = [room.name.title(), '\t ' + str(room.description), '']
+            exits = self.get_adjacent_rooms(room_name)
+            for direction in exits:
+                lines.append('%s is to the %s.' % (exits[direction].title(), direction))
+            render = self.renders.keep(room_name, ('\n'.join(lines), describe_objects(room.objects)))
+        return render
+
     def get_adjacent_rooms(self, room_name):
-        return dict(self.mappings[room_name])
+        '''
+        direction -> room, not to be changed
+        '''
+        return self.mappings.get(room_name, {})
     
     def go(self, from_room, direction):
-        for (to_dir, to_room) in self.mappings[from_room]:
-            if direction == to_dir:
-                return to_room
+        return self.mappings.get(from_room, {}).get(direction)
+
+    def eat(self, tokens):
+        return self.vocabulary.eat(tokens)
+
+    def get_routes(self, to_room):
+        routes = self.routes.use(to_room)
+        if routes == None:
+            routes = {to_room: (0, None, None)}
+            rooms = [to_room]
+            # breadth first from the destination, walking ways backwards
+            for room in rooms:
+                distance = routes[room][0] + 1
+                for (from_room, direction) in self.entrances.get(room, ()):
+                    if from_room not in routes:
+                        routes[from_room] = (distance, direction, room)
+                        rooms.append(from_room)
+            self.routes.keep(to_room, routes)
+        return routes
+
+    def route(self, from_room, to_room):
+        '''
+        The directions to go in to get from one room to another the shortest
+        way, or None if there is no way
+        '''
+        routes = self.get_routes(to_room)
+        if from_room not in routes:
+            return None
+        directions = []
+        while from_room != to_room:
+            distance, direction, from_room = routes[from_room]
+            directions.append(direction)
+        return directions
+
+    def reachable(self, from_room, to_room):
+        return from_room in self.get_routes(to_room)
+
+    def reachable_from(self, room_name):
+        '''
+        Every room that can be reached from a room
+        '''
+        reached = {room_name}
+        rooms = [room_name]
+        for room in rooms:
+            for next_room in self.mappings.get(room, {}).values():
+                if next_room not in reached:
+                    reached.add(next_room)
+                    rooms.append(next_room)
+        return reached
             
 class Directions:
-    def __init__(self, game):
+    def __init__(self, world):
         self.directions = []
         self.opposites = {}
-        self.game = game
+        self.world = world
+        self.vocabulary = Vocabulary()
 
     def direction(self, name, *aliases):
-        self.directions.append([name] + list(aliases))
+        direction = [name] + list(aliases)
+        self.directions.append(direction)
+        for alias in direction:
+            self.vocabulary.add(alias.split(' '), name)
+        self.world.vocabulary_changed()
         return self
 
     def canonicalize(self, name):
-        for direction in self.directions:
-            if name in direction:
-                return direction[0]
+        return self.vocabulary.get(name.split(' '))
 
     def enumerate(self):
         all_directions = []
@@ -571,9 +1996,8 @@ class Directions:
                 all_directions.append(alias)
         return sorted(all_directions, key=len, reverse=True)
 
-    def eat(self, tokens):
-        match_tokens = eat(map(lambda x: x.split(' '), self.enumerate()), tokens)
-        return self.canonicalize(' '.join(match_tokens)) if match_tokens else None
+    def eat(self, tokens, typos=False):
+        return self.vocabulary.eat(tokens, typos)
     
     def opposite(self, name, opposite_name):
         name = self.canonicalize(name)
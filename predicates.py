@@ -1,3 +1,6 @@
+# the parts of a game's state a predicate can read
+facts = ('inventory', 'room', 'visited', 'room_objects', 'descriptions', 'turn')
+
 class Predicate:
     def __init__(self, name, *args):
         self.name = name
@@ -11,3 +14,37 @@ def has_visited(room):
 
 def in_room(room):
     return Predicate('in_room', room)
+
+def check_inventory_has(game, object):
+    return game.inventory_has(object)
+
+def check_has_visited(game, room):
+    return game.has_visited(room)
+
+def check_in_room(game, room):
+    return room == game.room
+
+# how each predicate is evaluated, by name
+checks = {
+    'inventory_has': check_inventory_has,
+    'has_visited': check_has_visited,
+    'in_room': check_in_room
+}
+
+class CachedCheck:
+    '''
+    A predicate whose results each game keeps (see Game.cached_check)
+    until one of the facts it reads changes
+    '''
+    __slots__ = ('name', 'check', 'reads')
+
+    def __init__(self, name, check, reads):
+        self.name = name
+        self.check = check
+        self.reads = tuple(reads)
+
+    def __call__(self, game, *args):
+        return game.cached_check(self, args)
+
+    def __repr__(self):
+        return self.name
@@ -0,0 +1,147 @@
+import time
+
+from side_effects import SideEffect
+from lib import CompiledSideEffect, CompiledProgn, CompiledCond
+
+class Profiler:
+    '''
+    Times where each command a game runs spends its time. Give one to
+    `Game.set_profiler`.
+
+    Time is split between nested phases, each phase only counting the time
+    not spent in the phases inside it. Phases are names ('actions.eat',
+    'notify', 'print_room', ...) or the reaction or side effect that ran.
+    When a command is done `callback(action, timings)` is called with a
+    dict of phase -> seconds.
+    '''
+    def __init__(self, callback=None, clock=time.perf_counter):
+        self.callback = callback
+        self.clock = clock
+        self.stack = []
+        self.timings = None
+        self.last = 0.0
+
+    def begin(self):
+        self.timings = {}
+        self.stack = ['execute']
+        self.last = self.clock()
+
+    def charge(self):
+        now = self.clock()
+        phase = self.stack[-1]
+        self.timings[phase] = self.timings.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def enter(self, phase):
+        if self.timings != None:
+            self.charge()
+            self.stack.append(phase)
+
+    def exit(self):
+        if self.timings != None:
+            self.charge()
+            self.stack.pop()
+
+    def switch(self, phase):
+        '''
+        Ends the current phase and starts the next one at the same level
+        '''
+        if self.timings != None:
+            self.charge()
+            self.stack[-1] = phase
+
+    def end(self, action):
+        if self.timings == None:
+            return None
+        self.charge()
+        timings = self.timings
+        self.timings = None
+        if self.callback:
+            self.callback(action, timings)
+        return timings
+
+class Aggregator:
+    '''
+    A Profiler callback keeping, for each action and phase, how many times
+    it ran, the total time and a histogram of times in power of two
+    microsecond buckets
+    '''
+    def __init__(self):
+        # (action, phase) -> [count, seconds, {bucket: count}]
+        self.stats = {}
+
+    def __call__(self, action, timings):
+        for phase in timings:
+            seconds = timings[phase]
+            key = (action, phase)
+            stat = self.stats.get(key)
+            if stat == None:
+                stat = self.stats[key] = [0, 0.0, {}]
+            stat[0] += 1
+            stat[1] += seconds
+            bucket = int(seconds * 1e6).bit_length()
+            stat[2][bucket] = stat[2].get(bucket, 0) + 1
+
+    def histogram(self, action, phase):
+        '''
+        (upper bound in microseconds, count) for each bucket
+        '''
+        stat = self.stats.get((action, phase))
+        if not stat:
+            return []
+        return [(1 << bucket, stat[2][bucket]) for bucket in sorted(stat[2])]
+
+    def report(self, world=None):
+        labels = reaction_labels(world) if world else {}
+        lines = []
+        for key in sorted(self.stats, key=lambda x: -self.stats[x][1]):
+            count, seconds, buckets = self.stats[key]
+            lines.append('%-12s %-40s %8d %12.1fus %10.2fus' % (
+                key[0], label(key[1], labels), count, seconds * 1e6, seconds * 1e6 / count))
+        return '\n'.join(lines)
+
+def label(phase, labels={}):
+    if type(phase) == str:
+        return phase
+    if isinstance(phase, SideEffect):
+        return '%s%r' % (type(phase).__name__, phase.args)
+    return labels.get(phase, repr(phase))
+
+def reaction_labels(world):
+    '''
+    Where each compiled reaction of a world was registered
+    '''
+    labels = {}
+    for object in world.objects.objects:
+        for action_name in object.callbacks:
+            labels[object.callbacks[action_name]] = 'on %s %s' % (object.name, action_name)
+    names = world.object_ids.names
+    for (source, target) in world.objects.use_callbacks:
+        labels.setdefault(world.objects.use_callbacks[(source, target)],
+                          'on use %s on %s' % (names[source], names[target]))
+    for action_name in world.actions.reactions:
+        labels[world.actions.reactions[action_name]] = 'action %s' % action_name
+    listeners = world.character.transitions.listeners
+    for (event, from_room, to_room) in listeners:
+        for reaction in listeners[(event, from_room, to_room)]:
+            labels[reaction] = '%s %s -> %s' % (event, from_room or '*', to_room or '*')
+    for reaction in list(labels):
+        for later in later_reactions(reaction):
+            labels.setdefault(later, 'later in %s' % labels[reaction])
+    return labels
+
+def later_reactions(reaction):
+    '''
+    The reactions a compiled reaction has side effects run later, like
+    after_turns, and the ones those run later
+    '''
+    if type(reaction) == CompiledSideEffect:
+        for later in reaction.side_effect.reactions():
+            yield later
+            yield from later_reactions(later)
+    elif type(reaction) == CompiledProgn:
+        for statement in reaction.statements:
+            yield from later_reactions(statement)
+    elif type(reaction) == CompiledCond:
+        yield from later_reactions(reaction.then_part)
+        yield from later_reactions(reaction.else_part)
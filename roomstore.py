@@ -0,0 +1,110 @@
+import collections
+import json
+import sqlite3
+import threading
+
+from lib import Room
+
+class RoomStore:
+    '''
+    Rooms kept in a sqlite file and only loaded when a game looks at them,
+    with the `capacity` most recently used rooms kept in memory. Use it in
+    place of the rooms dict of a world:
+
+        world.configure_rooms().use_store(RoomStore('rooms.db'))
+
+    Rooms are written to the file as they are added, so the rooms in
+    memory never differ from the file and any of them can be dropped.
+    What games change in rooms is kept in each game's own state, not in
+    the rooms, so it outlives the room being dropped.
+    '''
+    def __init__(self, path, capacity=10000):
+        self.path = path
+        self.capacity = capacity
+        self.open()
+
+    def open(self):
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('create table if not exists rooms '
+                                '(name text primary key, description text, objects text)')
+
+    def make_room(self, name, description, objects):
+        return Room(name, description, json.loads(objects))
+
+    def __getitem__(self, name):
+        with self.lock:
+            room = self.cache.get(name)
+            if room != None:
+                self.cache.move_to_end(name)
+                return room
+
+            row = self.connection.execute('select description, objects from rooms where name = ?',
+                                          (name,)).fetchone()
+            if row == None:
+                raise KeyError(name)
+            room = self.make_room(name, *row)
+            self.cache[name] = room
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+            return room
+
+    def __setitem__(self, name, room):
+        with self.lock:
+            self.connection.execute('insert or replace into rooms values (?, ?, ?)',
+                                    (name, room.description, json.dumps(list(room.objects))))
+            if name in self.cache:
+                self.cache[name] = room
+                self.cache.move_to_end(name)
+
+    def __contains__(self, name):
+        with self.lock:
+            if name in self.cache:
+                return True
+            return self.connection.execute('select 1 from rooms where name = ?',
+                                           (name,)).fetchone() != None
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        with self.lock:
+            names = self.connection.execute('select name from rooms').fetchall()
+        return [name for (name,) in names]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        '''
+        Every room, read straight from the file without being kept
+        '''
+        with self.lock:
+            rows = self.connection.execute('select name, description, objects from rooms').fetchall()
+        for row in rows:
+            yield self.make_room(*row)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('select count(*) from rooms').fetchone()[0]
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __getstate__(self):
+        self.commit()
+        return {'path': self.path, 'capacity': self.capacity}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.capacity = state['capacity']
+        self.open()
@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Timer:
+    '''
+    A reaction waiting to run in a game. Cancelled timers stay in their
+    scheduler until they come up, and are skipped then. `number` is the
+    timer's entry in its scheduler, older entries left behind by `again`
+    being skipped too, and `ran` is set once its reaction has run.
+    '''
+    __slots__ = ('game', 'reaction', 'source', 'target', 'cancelled', 'number', 'ran')
+
+    def __init__(self, game, reaction, source=None, target=None):
+        self.game = game
+        self.reaction = reaction
+        self.source = source
+        self.target = target
+        self.cancelled = False
+        self.number = None
+        self.ran = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    '''
+    Timers kept in a heap by when they are due, a turn number or a time
+    from `now`. Adding a timer and taking the next due one take time
+    logarithmic in how many are waiting, and finding out whether any are
+    due only looks at the first one, so any number can be waiting.
+
+    Each game keeps one for its turns (see Game.after_turns), and games
+    can share one for the wall clock (see Game.set_clock and
+    Game.after_seconds) which something has to `run` now and then, like
+    the server does.
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        # (when, number, timer), numbered so timers due at the same time
+        # run in the order they were added
+        self.heap = []
+        self.numbers = itertools.count()
+
+    def now(self):
+        return self.clock()
+
+    def at(self, when, game, reaction, source=None, target=None):
+        return self.again(Timer(game, reaction, source, target), when)
+
+    def again(self, timer, when):
+        '''
+        Makes a timer, cancelled or not, wait until `when`, and only then
+        '''
+        timer.cancelled = False
+        timer.number = next(self.numbers)
+        heapq.heappush(self.heap, (when, timer.number, timer))
+        return timer
+
+    def waiting(self):
+        '''
+        (when, timer) for the timers waiting, in the order they will run
+        '''
+        return [(when, timer) for (when, number, timer) in sorted(self.heap)
+                if not timer.cancelled and timer.number == number]
+
+    def next_time(self):
+        '''
+        When the next timer is due, or None if none are waiting
+        '''
+        heap = self.heap
+        while heap and (heap[0][2].cancelled or heap[0][2].number != heap[0][1]):
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def due(self, now):
+        '''
+        Takes out the timers due by `now`, earliest first, including any
+        added while going through them that are due too
+        '''
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            when, number, timer = heapq.heappop(heap)
+            if not timer.cancelled and timer.number == number:
+                yield timer
+
+    def run(self, now=None):
+        '''
+        Runs the reactions that are due in their games. Returns how many
+        ran. A reaction that raises is logged and the others still run,
+        since the games sharing the scheduler have nothing to do with it.
+        '''
+        ran = 0
+        for timer in self.due(self.now() if now == None else now):
+            # games that have left stop listening to the clock
+            if timer.game.clock is self:
+                try:
+                    timer.game.run_timer(timer)
+                except Exception:
+                    logger.exception('Timed reaction %r failed', timer.reaction)
+                ran += 1
+        return ran
+
+    def __len__(self):
+        return len(self.heap)
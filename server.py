@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import importlib
+import logging
+
+from lib import Game
+from sinks import StreamSink
+from scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+class Server:
+    '''
+    Hosts a game per connection, all playing the same (frozen) world.
+    Clients send one command per line and get that command's output back.
+    Lines longer than `max_line` bytes are answered with an error and
+    skipped, and a command that raises is logged and answered with an
+    error, the player staying connected either way.
+    '''
+    def __init__(self, world, max_sessions=1000, idle_timeout=None, prompt='> ',
+                 max_line=1024, write_buffer=64 * 1024, history=0):
+        self.world = world.freeze()
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.prompt = prompt
+        self.max_line = max_line
+        self.write_buffer = write_buffer
+        # how many commands each player can undo
+        self.history = history
+        # timed reactions of every game, run every `tick` seconds
+        self.clock = Scheduler()
+        self.tick = 0.1
+        self.sessions = 0
+
+    async def prompt_for(self, writer):
+        writer.write(self.prompt.encode('utf-8'))
+        # waits while the client is not reading what we already sent
+        await writer.drain()
+
+    async def read_line(self, reader):
+        '''
+        The next line from the client, b'' once it has disconnected, or
+        None if the line was too long, in which case all of it is skipped
+        '''
+        too_long = False
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+                return None if too_long else line
+            except asyncio.IncompleteReadError as error:
+                return b'' if too_long else error.partial
+            except asyncio.LimitOverrunError as error:
+                # drops what was read so far and keeps looking for the end
+                too_long = True
+                await reader.readexactly(error.consumed)
+
+    async def handle(self, reader, writer):
+        if self.sessions >= self.max_sessions:
+            writer.write(b'The game is full, try again later.\n')
+            await writer.drain()
+            writer.close()
+            return
+
+        self.sessions += 1
+        writer.transport.set_write_buffer_limits(high=self.write_buffer)
+        game = Game(self.world, StreamSink(writer)).set_history(self.history).set_clock(self.clock)
+        try:
+            game.print_room()
+            await self.prompt_for(writer)
+            while True:
+                line = await asyncio.wait_for(self.read_line(reader), self.idle_timeout)
+                if line == None:
+                    writer.write(b'That command is too long.\n')
+                    await self.prompt_for(writer)
+                    continue
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace')
+                try:
+                    game.execute(command)
+                except Exception:
+                    logger.exception('Command %r failed', command.rstrip('\n'))
+                    writer.write(b'Something went wrong, that command failed.\n')
+                await self.prompt_for(writer)
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            game.set_clock(None)
+            self.sessions -= 1
+            writer.close()
+
+    async def run_clock(self):
+        while True:
+            self.clock.run()
+            await asyncio.sleep(self.tick)
+
+    async def serve(self, host='localhost', port=4000):
+        server = await asyncio.start_server(self.handle, host, port, limit=self.max_line)
+        clock = asyncio.create_task(self.run_clock())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            clock.cancel()
+
+def load_world(module_name):
+    '''
+    The world compiled into a file by artifact.py, a world file (see
+    worldfile.py), or the world of a module defining `build_world()`,
+    `world` or `game`
+    '''
+    if module_name.endswith('.ptw'):
+        import artifact
+        return artifact.load(module_name)
+    if module_name.endswith('.world'):
+        import worldfile
+        return worldfile.load_path(module_name)
+
+    module = importlib.import_module(module_name)
+    if hasattr(module, 'build_world'):
+        return module.build_world()
+    if hasattr(module, 'world'):
+        return module.world
+    return module.game.world
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a world to many players over TCP')
+    parser.add_argument('--world', default='main', help='module defining the world, a .world file or a compiled .ptw world')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=4000)
+    parser.add_argument('--max-sessions', type=int, default=1000)
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='seconds before an idle player is disconnected')
+    parser.add_argument('--history', type=int, default=0,
+                        help='how many commands each player can undo')
+    args = parser.parse_args()
+
+    server = Server(load_world(args.world), max_sessions=args.max_sessions,
+                    idle_timeout=args.idle_timeout, history=args.history)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
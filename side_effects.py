@@ -1,49 +1,101 @@
-class SideEffect:
-    def __init__(self, *args):
-        self.args = args
-        
-        self.source = None
-        self.target = None
+class Context:
+    '''
+    What a side effect is running for: the game, and the names of the
+    source and target objects of the command. A new one is made for every
+    run, so side effects shared by many games never hold on to any game.
+    '''
+    __slots__ = ('game', 'source', 'target')
 
-    def call(self, game, source, target):
+    def __init__(self, game, source=None, target=None):
+        self.game = game
         self.source = source
         self.target = target
-        self.execute(game, *self.args)
 
     def default_to_source(self, input):
         return self.source if not input else input
 
     def default_to_target(self, input):
         return self.target if not input else input
+
+class SideEffect:
+    def __init__(self, *args):
+        self.args = args
+
+    def call(self, game, source, target):
+        self.execute(Context(game, source, target), *self.args)
         
-    def execute(self, game, args):
+    def execute(self, context, *args):
         raise Exception('Must implement `execute` for SideEffect')
 
+    def compile(self, compile):
+        '''
+        This side effect with the reactions it runs later compiled by
+        `compile`, for side effects that run reactions
+        '''
+        return self
+
+    def reactions(self):
+        '''
+        The reactions this side effect runs later
+        '''
+        return ()
+
 class AddToInventory(SideEffect):
-    def execute(self, game, object):
-        game.character.add_to_inventory(self.default_to_source(object), force=True)
+    def execute(self, context, object):
+        context.game.add_to_inventory(context.default_to_source(object), force=True)
 
 class RemoveFromInventory(SideEffect):
-    def execute(self, game, object):
-        game.character.inventory.remove(self.default_to_source(object))         
+    def execute(self, context, object):
+        context.game.remove_from_inventory(context.default_to_source(object))
 
 class Destroy(SideEffect):
-    def execute(self, game, object):
-        object = self.default_to_source(object)
-        if object in game.character.inventory:
-            game.character.inventory.remove(object)
+    def execute(self, context, object):
+        game = context.game
+        object = context.default_to_source(object)
+        if game.inventory_has(object):
+            game.remove_from_inventory(object)
             
-        room = game.rooms.get(game.character.room)
-        if object in room.objects:
-            game.rooms.get(game.character.room).objects.remove(object)
+        if game.room_has(game.room, object):
+            game.remove_room_object(game.room, object)
 
 class ChangeDescription(SideEffect):
-    def execute(self, game, object_name, new_description):
-        for object in game.objects.objects:
-            if object.name == object_name:
-                object.description = new_description
-                break;
+    def execute(self, context, object_name, new_description):
+        context.game.change_description(object_name, new_description)
             
+class AddRoomObject(SideEffect):
+    def execute(self, context, room_name, object):
+        game = context.game
+        game.add_room_object(room_name or game.room, context.default_to_source(object))
+
+class RemoveRoomObject(SideEffect):
+    def execute(self, context, room_name, object):
+        game = context.game
+        room_name = room_name or game.room
+        object = context.default_to_source(object)
+        if game.room_has(room_name, object):
+            game.remove_room_object(room_name, object)
+
+class Later(SideEffect):
+    '''
+    A side effect running a reaction later, with args (when, reaction)
+    '''
+    def compile(self, compile):
+        when, reaction = self.args
+        return type(self)(when, compile(reaction))
+
+    def reactions(self):
+        return (self.args[1],)
+
+class AfterTurns(Later):
+    def execute(self, context, turns, reaction):
+        game = context.game
+        game.after_turns(turns, reaction, game.objects.get(context.source), game.objects.get(context.target))
+
+class AfterSeconds(Later):
+    def execute(self, context, seconds, reaction):
+        game = context.game
+        game.after_seconds(seconds, reaction, game.objects.get(context.source), game.objects.get(context.target))
+
 def add_to_inventory(object=None):
     return AddToInventory(object)
 
@@ -55,3 +107,41 @@ def destroy(object=None):
 
 def change_description(object, new_description):
     return ChangeDescription(object, new_description)
+
+def add_room_object(room_name=None, object=None):
+    '''
+    Puts an object in a room, the current one if room_name is None
+    '''
+    return AddRoomObject(room_name, object)
+
+def remove_room_object(room_name=None, object=None):
+    '''
+    Takes an object out of a room (the current one if room_name is None)
+    if it is there
+    '''
+    return RemoveRoomObject(room_name, object)
+
+def after_turns(turns, reaction):
+    '''
+    Runs a reaction after `turns` more commands, like "the crab leaves
+    after 5 turns"
+    '''
+    return AfterTurns(turns, reaction)
+
+def after_seconds(seconds, reaction):
+    '''
+    Runs a reaction after `seconds`, in games with a clock
+    '''
+    return AfterSeconds(seconds, reaction)
+
+# each side effect by name, for worlds loaded from files
+effects = {
+    'add_to_inventory': AddToInventory,
+    'remove_from_inventory': RemoveFromInventory,
+    'destroy': Destroy,
+    'change_description': ChangeDescription,
+    'add_room_object': AddRoomObject,
+    'remove_room_object': RemoveRoomObject,
+    'after_turns': AfterTurns,
+    'after_seconds': AfterSeconds
+}
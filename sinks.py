@@ -0,0 +1,51 @@
+import sys
+
+class Sink:
+    '''
+    Where a game's output goes. A game hands a sink everything one command
+    printed in a single `write`.
+    '''
+    def write(self, text):
+        raise Exception('Must implement `write` for Sink')
+
+class FileSink(Sink):
+    '''
+    Writes to a file-like object, stdout by default
+    '''
+    def __init__(self, file=None):
+        self.file = file
+
+    def write(self, text):
+        (self.file or sys.stdout).write(text)
+
+class ListSink(Sink):
+    '''
+    Keeps every write, to be read back later
+    '''
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def getvalue(self):
+        return ''.join(self.writes)
+
+    def clear(self):
+        self.writes.clear()
+
+class NullSink(Sink):
+    def write(self, text):
+        pass
+
+class StreamSink(Sink):
+    '''
+    Writes to an asyncio StreamWriter. Whoever owns the writer should await
+    `drain()` after each command.
+    '''
+    def __init__(self, writer, encoding='utf-8'):
+        self.writer = writer
+        self.encoding = encoding
+
+    def write(self, text):
+        self.writer.write(text.encode(self.encoding))
@@ -0,0 +1,204 @@
+'''
+A compact binary form of a game's state, without any of the world.
+
+    magic 'PTGS', version byte
+    strings: count, then each as length + utf-8
+    room (0 for none, else string number + 1)
+    inventory: count, then (string, times) pairs
+    visited rooms: count, then strings
+    changed rooms: count, then room string and its (string, times) pairs
+        sorted by name
+    changed descriptions: count, then (object string, description string)
+    turn
+    timers: count, then (turns left, reaction number, source, target) in
+        the order they run, source and target written like the room
+    undo history: count, then for each command (oldest first) its
+        changes: count, then each as its kind string, argument count and
+        arguments written like the room, except that a 'schedule' change
+        is followed by (turns, reaction number, source, target, whether
+        it ran, its timer's number + 1 or 0 if it is not waiting)
+    redo history: the same
+
+Every number is a varint and names are stored once in the string table.
+Sets and dicts are written sorted so equal states give equal bytes.
+
+Version 1 snapshots, from before the turn and timers were kept, still load
+as being at turn 0 with no timers, and version 1 and 2 snapshots load with
+no history.
+'''
+
+MAGIC = b'PTGS'
+VERSION = 3
+
+def write_number(out, number):
+    while number >= 0x80:
+        out.append(number & 0x7f | 0x80)
+        number >>= 7
+    out.append(number)
+
+class Reader:
+    def __init__(self, data, position=0):
+        self.data = data
+        self.position = position
+
+    def number(self):
+        data = self.data
+        number = 0
+        shift = 0
+        while True:
+            byte = data[self.position]
+            self.position += 1
+            number |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def string(self):
+        length = self.number()
+        start = self.position
+        self.position += length
+        return self.data[start:self.position].decode('utf-8')
+
+    def optional(self, strings):
+        number = self.number()
+        return strings[number - 1] if number else None
+
+    def counts(self, strings):
+        counts = {}
+        for i in range(self.number()):
+            name = strings[self.number()]
+            counts[name] = self.number()
+        return counts
+
+def dumps(room, inventory, visited_rooms, room_objects, descriptions, turn=0, timers=(),
+          undos=(), redos=()):
+    '''
+    inventory and each of room_objects' values are dicts of name -> times,
+    timers are (turns left, reaction number, source name or None, target
+    name or None), and undos and redos are lists of each command's changes,
+    (kind, *names or None) as recorded by Game.record, or ('schedule',
+    turns, reaction number, source, target, ran, timer number + 1 or 0)
+    '''
+    strings = {}
+    def index(string):
+        number = strings.get(string)
+        if number == None:
+            number = strings[string] = len(strings)
+        return number
+
+    body = bytearray()
+    def write_optional(name):
+        write_number(body, 0 if name == None else index(name) + 1)
+
+    write_optional(room)
+
+    def write_counts(counts, names):
+        write_number(body, len(counts))
+        for name in names:
+            write_number(body, index(name))
+            write_number(body, counts[name])
+
+    # inventory order is how it is shown, so it is kept
+    write_counts(inventory, inventory)
+
+    write_number(body, len(visited_rooms))
+    for name in sorted(visited_rooms):
+        write_number(body, index(name))
+
+    write_number(body, len(room_objects))
+    for name in sorted(room_objects):
+        write_number(body, index(name))
+        # rooms list their objects sorted
+        write_counts(room_objects[name], sorted(room_objects[name]))
+
+    write_number(body, len(descriptions))
+    for name in sorted(descriptions):
+        write_number(body, index(name))
+        write_number(body, index(descriptions[name]))
+
+    write_number(body, turn)
+    write_number(body, len(timers))
+    for turns, reaction, source, target in timers:
+        write_number(body, turns)
+        write_number(body, reaction)
+        write_optional(source)
+        write_optional(target)
+
+    for history in (undos, redos):
+        write_number(body, len(history))
+        for changes in history:
+            write_number(body, len(changes))
+            for change in changes:
+                write_number(body, index(change[0]))
+                if change[0] == 'schedule':
+                    kind, turns, reaction, source, target, ran, timer = change
+                    write_number(body, turns)
+                    write_number(body, reaction)
+                    write_optional(source)
+                    write_optional(target)
+                    write_number(body, 1 if ran else 0)
+                    write_number(body, timer)
+                    continue
+                write_number(body, len(change) - 1)
+                for name in change[1:]:
+                    write_optional(name)
+
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    write_number(out, len(strings))
+    for string in strings:
+        encoded = string.encode('utf-8')
+        write_number(out, len(encoded))
+        out += encoded
+    return bytes(out + body)
+
+def loads(data):
+    '''
+    (room, inventory, visited rooms, room objects, descriptions, turn,
+    timers, undos, redos) as given to `dumps`
+    '''
+    if data[:4] != MAGIC:
+        raise Exception('Not a game snapshot')
+    version = data[4]
+    if version not in (1, 2, VERSION):
+        raise Exception('Unknown snapshot version %d' % version)
+
+    reader = Reader(data, 5)
+    strings = [reader.string() for i in range(reader.number())]
+
+    room = reader.optional(strings)
+    inventory = reader.counts(strings)
+    visited_rooms = set(strings[reader.number()] for i in range(reader.number()))
+
+    room_objects = {}
+    for i in range(reader.number()):
+        name = strings[reader.number()]
+        room_objects[name] = reader.counts(strings)
+
+    descriptions = {}
+    for i in range(reader.number()):
+        name = strings[reader.number()]
+        descriptions[name] = strings[reader.number()]
+
+    turn = 0
+    timers = []
+    if version > 1:
+        turn = reader.number()
+        for i in range(reader.number()):
+            timers.append((reader.number(), reader.number(), reader.optional(strings), reader.optional(strings)))
+
+    histories = ([], [])
+    if version > 2:
+        for history in histories:
+            for i in range(reader.number()):
+                changes = []
+                for j in range(reader.number()):
+                    kind = strings[reader.number()]
+                    if kind == 'schedule':
+                        changes.append((kind, reader.number(), reader.number(), reader.optional(strings),
+                                        reader.optional(strings), reader.number() == 1, reader.number()))
+                    else:
+                        changes.append((kind,) + tuple(reader.optional(strings) for k in range(reader.number())))
+                history.append(changes)
+
+    return (room, inventory, visited_rooms, room_objects, descriptions, turn, timers) + histories
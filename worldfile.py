@@ -0,0 +1,167 @@
+'''
+Worlds written as data instead of code. A world file has one JSON object
+per line, each one configuring part of the world the same way the
+configure_* api does. Lines are applied in order, so define directions
+before mapping rooms with them and objects before giving them reactions.
+Blank lines and lines starting with # are skipped.
+
+    {"direction": "east", "aliases": ["e"]}
+    {"opposite": ["east", "west"]}
+    {"action": "look", "aliases": ["l", "check out"]}
+    {"stop_words": ["in", "on", "the", "with", "to"]}
+    {"object": "key", "description": "A dirty key", "actions": ["look", "take"]}
+    {"on": "key", "action": "eat", "reaction": <reaction>}
+    {"on_use": ["key", "towel"], "reaction": <reaction>, "bidirectional": true}
+    {"room": "bathroom", "description": "A well kept bathroom.", "objects": ["towel"]}
+    {"map": ["living room", "west", "bathroom"], "bidirectional": true}
+    {"starting_room": "living room"}
+    {"inventory_size": 10}
+    {"on_enter": "bathroom", "reaction": <reaction>}
+    {"on_exit": "living room", "reaction": <reaction>}
+    {"on_enter_from": ["living room", "bathroom"], "reaction": <reaction>}
+    {"on_exit_to": ["living room", "bathroom"], "reaction": <reaction>}
+    {"go_action": "go"}, {"look_action": "look"}, {"take_action": "take"},
+    {"undo_action": "undo"}, {"redo_action": "redo"}
+    {"allow_typos": true}
+
+A reaction is one of
+
+    {"succeed": "message"}, {"fail": "message"}, {"info": "message"}
+        with an optional "silence": true/false
+    {"progn": [<reaction>, ...]}
+    {"cond": [<predicate>, <then reaction>, <else reaction>]}
+    {"<side effect>": <argument or [arguments]>}
+        e.g. {"add_to_inventory": "taco"}, {"destroy": null},
+        {"change_description": ["car", "A dirty red van"]},
+        {"remove_room_object": ["living room", "crab"]},
+        {"after_turns": [5, <reaction>]}, {"after_seconds": [30, <reaction>]}
+
+and a predicate is {"<predicate>": <argument or [arguments]>}, e.g.
+{"inventory_has": "key"}. Null and missing reactions do nothing.
+
+The file is read a line at a time, so only the world itself is kept in
+memory while loading.
+'''
+import json
+
+from lib import World, Progn, Result, Cond
+from predicates import Predicate
+import side_effects
+
+def arguments(value):
+    return tuple(value) if type(value) == list else (value,)
+
+def make_reaction(data, world):
+    if data == None:
+        return None
+    if type(data) != dict:
+        raise Exception('A reaction must be an object, not %r' % data)
+
+    for name in ('succeed', 'fail', 'info'):
+        if name in data:
+            return Result(name != 'fail', data[name] or '', data.get('silence', name != 'info'))
+    if 'progn' in data:
+        return Progn([make_reaction(statement, world) for statement in data['progn']])
+    if 'cond' in data:
+        predicate, then_part, else_part = (list(data['cond']) + [None, None])[:3]
+        return Cond(make_predicate(predicate, world),
+                    make_reaction(then_part, world),
+                    make_reaction(else_part, world))
+    if len(data) == 1:
+        name = next(iter(data))
+        if name in side_effects.effects:
+            args = arguments(data[name])
+            if name in ('after_turns', 'after_seconds'):
+                args = (args[0], make_reaction(args[1], world))
+            return side_effects.effects[name](*args)
+    raise Exception('Unknown reaction %s' % json.dumps(data))
+
+def make_predicate(data, world):
+    if type(data) != dict or len(data) != 1:
+        raise Exception('A predicate must be an object with one key, not %r' % data)
+    name = next(iter(data))
+    if name not in world.predicates:
+        raise Exception('Unknown predicate "%s"' % name)
+    return Predicate(name, *arguments(data[name]))
+
+def apply(record, world):
+    '''
+    Configures the world with one record of a world file
+    '''
+    def reaction():
+        return make_reaction(record.get('reaction'), world)
+
+    if 'direction' in record:
+        world.configure_directions().direction(record['direction'], *record.get('aliases', []))
+    elif 'opposite' in record:
+        world.configure_directions().opposite(*record['opposite'])
+    elif 'action' in record and 'on' not in record:
+        aliases = list(record.get('aliases', []))
+        if 'reaction' in record:
+            aliases.append(reaction())
+        world.configure_actions().action(record['action'], *aliases)
+    elif 'stop_words' in record:
+        world.configure_actions().stop_words(*record['stop_words'])
+    elif 'object' in record:
+        world.configure_objects().object(record['object'], record.get('description', ''),
+                                         record.get('actions', []))
+    elif 'on' in record:
+        world.configure_objects().on(record['on'], record['action'], reaction())
+    elif 'on_use' in record:
+        source, target = record['on_use']
+        world.configure_objects().on_use(source, target, reaction(),
+                                         record.get('bidirectional', True))
+    elif 'room' in record:
+        world.configure_rooms().room(record['room'], record.get('description', ''),
+                                     record.get('objects'))
+    elif 'map' in record:
+        from_room, direction, to_room = record['map']
+        world.configure_rooms().map(from_room, direction, to_room,
+                                    record.get('bidirectional', True))
+    elif 'starting_room' in record:
+        world.configure_character().starting_room(record['starting_room'])
+    elif 'inventory_size' in record:
+        world.configure_character().inventory_size(record['inventory_size'])
+    elif 'on_enter' in record:
+        world.configure_character().on_enter(record['on_enter'], reaction())
+    elif 'on_exit' in record:
+        world.configure_character().on_exit(record['on_exit'], reaction())
+    elif 'on_enter_from' in record:
+        world.configure_character().on_enter_from(*record['on_enter_from'], reaction())
+    elif 'on_exit_to' in record:
+        world.configure_character().on_exit_to(*record['on_exit_to'], reaction())
+    elif 'go_action' in record:
+        world.set_go_action_name(record['go_action'])
+    elif 'look_action' in record:
+        world.set_look_action_name(record['look_action'])
+    elif 'take_action' in record:
+        world.set_take_action_name(record['take_action'])
+    elif 'undo_action' in record:
+        world.set_undo_action_name(record['undo_action'])
+    elif 'redo_action' in record:
+        world.set_redo_action_name(record['redo_action'])
+    elif 'allow_typos' in record:
+        if record['allow_typos']:
+            world.allow_typos()
+    else:
+        raise Exception('Unknown record %s' % json.dumps(record))
+
+def load(lines, world=None):
+    '''
+    Builds a world from the lines of a world file (an open file or any
+    iterable of strings)
+    '''
+    world = world if world != None else World()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            apply(json.loads(line), world)
+        except Exception as error:
+            raise Exception('Line %d: %s' % (number, error))
+    return world
+
+def load_path(path, world=None):
+    with open(path, encoding='utf-8') as file:
+        return load(file, world)